@@ -1,11 +1,23 @@
 import os
+import tempfile
+import time
+import uuid
 import streamlit as st
 import pandas as pd
-import sqlite3
 from groq import Groq
 
 
-from sujal_codio_project import create_connection, ex1, ex2, ex3, ex4, ex5, ex6, ex7, ex8, ex9, ex10, ex11
+from sujal_codio_project import (
+    ex3, ex4, ex5, ex6, ex7, ex8, ex9, ex10, ex11,
+    ex2_fact, ex3_fact, ex4_fact, ex5_fact, ex6_fact, ex7_fact, ex8_fact, ex9_fact, ex10_fact,
+    ex1_by_customer_id, ex2_by_customer_id, search_customer_names,
+)
+from dashboard_backend import (
+    FakeGroqClient, KeysetPager, MetricsStore, QueryCancelled, QueryGuard, QueryRejected,
+    QueryResultCache, ReadOnlyConnectionPool, ReportRunner, TranslationCache, export_query,
+    frame_size, stream_translation,
+)
+from report_engines import ArrowReportEngine, FrameReportEngine, snapshot_generation
 
 
 st.set_page_config(
@@ -14,10 +26,19 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
+RERUN_STARTED = time.perf_counter()
 
 DB_PATH = "normalized.db"
 APP_PASSWORD = os.getenv("APP_PASSWORD", "12345678")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_MODEL = "llama-3.3-70b-versatile"
+NL2SQL_CACHE_PATH = os.getenv("NL2SQL_CACHE_PATH", "nl2sql_cache.db")
+NL2SQL_CACHE_TTL = int(os.getenv("NL2SQL_CACHE_TTL", 7 * 24 * 3600))
+METRICS_PATH = os.getenv("METRICS_PATH", "dashboard_metrics.db")
+# Written by run_etl_pipeline(..., snapshot_dir=...) / incremental_ingest; read by the Arrow engine
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "normalized_snapshot")
+# Open the app with ?admin=<token> to see the latency panel; unset hides it entirely
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
 if "authenticated" not in st.session_state:
@@ -47,30 +68,119 @@ if not st.session_state.authenticated:
 
 
 
-if not GROQ_API_KEY:
-    st.error("⚠️ System Alert: GROQ_API_KEY not found in environment variables.")
-    st.stop()
+if os.getenv("GROQ_FAKE"):
+    # Local stand-in that streams canned SQL, for working on the app without an API key
+    groq_client = FakeGroqClient()
+else:
+    if not GROQ_API_KEY:
+        st.error("⚠️ System Alert: GROQ_API_KEY not found in environment variables.")
+        st.stop()
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+    groq_client = Groq(api_key=GROQ_API_KEY)
 
 
 @st.cache_resource
-def get_connection():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    return conn
-
-@st.cache_data
-def get_customer_names():
-    conn = get_connection()
-    df = pd.read_sql_query(
-        "SELECT DISTINCT FirstName || ' ' || LastName AS Name FROM Customer ORDER BY Name;",
-        conn,
-    )
-    return df["Name"].tolist()
+def get_pool():
+    # Read-only connections checked out per session thread instead of one shared handle
+    return ReadOnlyConnectionPool(DB_PATH, max_size=8, query_timeout=30.0)
+
+@st.cache_resource
+def get_query_cache():
+    # One cache shared by every session; invalidated when the database changes
+    return QueryResultCache(DB_PATH)
+
+@st.cache_resource
+def get_report_runner():
+    # Background executor for the Standard Reports tab, shared by all sessions
+    return ReportRunner(get_pool(), cache=get_query_cache(), max_workers=4, metrics=get_metrics())
+
+@st.cache_resource
+def get_query_guard():
+    # Limits for SQL the app did not write itself (Custom SQL Query and the AI Analyst)
+    return QueryGuard(max_rows=10000, preview_limit=1000)
+
+@st.cache_resource
+def get_translation_cache():
+    # Persistent NL -> SQL answers, shared by every session
+    return TranslationCache(NL2SQL_CACHE_PATH, ttl=NL2SQL_CACHE_TTL)
+
+@st.cache_resource
+def get_metrics():
+    # Rolling store of timing spans shared by every session
+    return MetricsStore(METRICS_PATH)
+
+@st.cache_resource(max_entries=1)
+def load_arrow_engine(generation: int):
+    # One memory-mapped snapshot per load generation, shared by every session
+    return ArrowReportEngine(SNAPSHOT_DIR)
+
+def get_arrow_engine():
+    # None unless the snapshot matches the database's current load, so the
+    # Arrow engine never serves results SQLite would not
+    generation = snapshot_generation(SNAPSHOT_DIR)
+    with get_pool().connection() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if generation is None or generation != current:
+        return None
+    return load_arrow_engine(generation)
 
-def run_query(sql: str) -> pd.DataFrame:
-    conn = get_connection()
-    return pd.read_sql_query(sql, conn)
+@st.cache_resource
+def get_frame_engine():
+    # Compact in-memory copy of the report tables; reloads itself when the database changes
+    return FrameReportEngine(DB_PATH)
+
+@st.cache_data(max_entries=1000, ttl=600)
+def search_customers(prefix: str, limit: int = 20):
+    # Only the top matches for what has been typed so far ever leave the database
+    with get_pool().connection() as conn:
+        return search_customer_names(conn, prefix, limit)
+
+def wait_for_job(job) -> pd.DataFrame:
+    with st.status("Running report…", expanded=False) as status:
+        while not job.done():
+            status.update(label=f"Running report… {job.elapsed():.1f}s")
+            time.sleep(0.1)
+        df = job.result()
+        status.update(label=f"Finished in {job.elapsed():.2f}s", state="complete")
+    return df
+
+# Standard reports and the exN function behind each
+REPORT_VIEWS = {
+    "Customer Orders History (ex1)": "ex1",
+    "Individual Sales Total (ex2)": "ex2",
+    "Global Sales Summary (ex3)": "ex3",
+    "Sales by Region (ex4)": "ex4",
+    "Sales by Country (ex5)": "ex5",
+    "Country Rank by Region (ex6)": "ex6",
+    "Top Country per Region (ex7)": "ex7",
+    "Customer Sales by Quarter (ex8)": "ex8",
+    "Top Customers per Quarter (ex9)": "ex9",
+    "Monthly Sales Rank (ex10)": "ex10",
+    "Longest Gap Between Orders (ex11)": "ex11",
+}
+REPORT_SQL = {"ex3": ex3, "ex4": ex4, "ex5": ex5, "ex6": ex6, "ex7": ex7, "ex8": ex8, "ex9": ex9,
+              "ex10": ex10, "ex11": ex11}
+# The same reports over the denormalized SalesFact table (ex1 and ex11 have no fact version)
+FACT_REPORT_SQL = {"ex2": ex2_fact, "ex3": ex3_fact, "ex4": ex4_fact, "ex5": ex5_fact, "ex6": ex6_fact,
+                   "ex7": ex7_fact, "ex8": ex8_fact, "ex9": ex9_fact, "ex10": ex10_fact}
+
+# Reports shown a page at a time, with the keyset used to walk them
+PAGE_SIZE = 100
+PAGED_REPORTS = {
+    "Customer Orders History (ex1)": ["OrderID"],
+    "Global Sales Summary (ex3)": [("Total", "DESC"), "Name"],
+    "Customer Sales by Quarter (ex8)": ["Year", "Quarter", "CustomerID"],
+}
+# Aggregates are paged over their cached full result rather than re-grouped per page
+MATERIALIZED_PAGES = {"Global Sales Summary (ex3)", "Customer Sales by Quarter (ex8)"}
+
+def get_pager(sql: str, params, key, materialize=False) -> KeysetPager:
+    # One pager per session, replaced when the report or its parameters change
+    pager = st.session_state.get("pager")
+    if pager is None or pager.sql != sql.strip().rstrip(";") or pager.params != tuple(params):
+        pager = KeysetPager(get_pool(), sql, params, key=key, page_size=PAGE_SIZE, materialize=materialize)
+        st.session_state["pager"] = pager
+    return pager
 
 
 with st.sidebar:
@@ -78,11 +188,39 @@ with st.sidebar:
     st.title("Control Panel")
     
     st.markdown("### 👤 User Settings")
-    customers = get_customer_names()
+    customer_prefix = st.text_input("Search customers", placeholder="Start typing a name…")
+    with get_metrics().span("customer_search") as span:
+        customers = search_customers(customer_prefix)
+        span["rows"] = len(customers)
     selected_customer = st.selectbox("Active Customer Profile", customers)
+    if not customers:
+        st.caption("No customers match that name.")
+    query_budget = st.slider("Report time budget (seconds)", 5, 300, 60, step=5)
+    report_engine = st.radio("Report engine", ["SQLite", "SalesFact", "Arrow snapshot", "In-memory frames"],
+                             horizontal=True,
+                             help="Arrow and in-memory frames answer the standard reports with pandas/numpy "
+                                  "instead of SQLite, with identical results. SalesFact runs them in SQLite "
+                                  "over the denormalized fact table; it adds in a different order, so a total "
+                                  "exactly on a rounding half-step can round the other way")
     
     st.markdown("---")
     st.info(f"**Database:** `{DB_PATH}`\n\n**Status:** Connected ✅")
+    cache_stats = get_query_cache().stats()
+    st.caption(
+        f"Query cache: {cache_stats['hit_rate']:.0%} hit rate, "
+        f"{cache_stats['entries']} results, {cache_stats['bytes'] / 1024 / 1024:.1f} MB"
+    )
+    nl2sql_stats = get_translation_cache().stats()
+    st.caption(
+        f"AI translation cache: {nl2sql_stats['entries']} saved, "
+        f"{nl2sql_stats['hits'] + nl2sql_stats['coalesced']} hits / {nl2sql_stats['misses']} misses"
+    )
+    pool_stats = get_pool().stats()
+    st.caption(
+        f"Connections: {pool_stats['in_use']}/{pool_stats['size']} in use "
+        f"(peak {pool_stats['peak_in_use']}), {pool_stats['waits']} waits, "
+        f"{pool_stats['query_timeouts']} timeouts"
+    )
     
     if st.button("Logout", type="secondary"):
         st.session_state.authenticated = False
@@ -103,12 +241,7 @@ with tab_reports:
         st.subheader("Report Type")
         query_option = st.radio(
             "Select Analysis View:",
-            [
-                "Customer Orders History (ex1)",
-                "Individual Sales Total (ex2)",
-                "Global Sales Summary (ex3)",
-                "Custom SQL Query",
-            ],
+            list(REPORT_VIEWS) + ["Custom SQL Query"],
             label_visibility="collapsed"
         )
     
@@ -117,6 +250,7 @@ with tab_reports:
         
        
         sql = ""
+        params = ()
         run_data = False
         
       
@@ -132,30 +266,112 @@ with tab_reports:
         else:
          
             run_data = True
-            if query_option == "Customer Orders History (ex1)":
-                sql = ex1(get_connection(), selected_customer)
-            elif query_option == "Individual Sales Total (ex2)":
-                sql = ex2(get_connection(), selected_customer)
-            elif query_option == "Global Sales Summary (ex3)":
-                sql = ex3(get_connection())
+            report_name = REPORT_VIEWS[query_option]
+            if selected_customer is None and report_name in ("ex1", "ex2"):
+                st.info("Pick a customer in the sidebar first.")
+                run_data = False
+            else:
+                with get_pool().connection() as conn:
+                    use_fact = report_engine == "SalesFact" and report_name in FACT_REPORT_SQL
+                    if use_fact and conn.execute(
+                            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'SalesFact'").fetchone() is None:
+                        st.caption("No SalesFact table in this database; running the base SQL.")
+                        use_fact = False
+                    if report_name == "ex1":
+                        sql, params = ex1_by_customer_id(conn, selected_customer, include_order_id=True)
+                    elif use_fact and report_name == "ex2":
+                        sql, params = ex2_fact(conn, selected_customer)
+                    elif use_fact:
+                        sql = FACT_REPORT_SQL[report_name](conn)
+                    elif report_name == "ex2":
+                        sql, params = ex2_by_customer_id(conn, selected_customer)
+                    else:
+                        sql = REPORT_SQL[report_name](conn)
 
     
         if run_data:
            
             with st.expander("🔍 View Generated SQL Source"):
                 st.code(sql, language="sql")
+                if params:
+                    st.caption(f"Parameters: {params}")
             
+            # Runs in the background; a rerun that submits another report for this
+            # session cancels this one instead of waiting for it
+            session_key = st.session_state.setdefault("report_session", uuid.uuid4().hex)
+            guard = get_query_guard() if query_option == "Custom SQL Query" else None
+            runner = get_report_runner()
+
+            def run_report(report_sql, report_params):
+                with get_metrics().span("report", label=query_option, sql=report_sql) as span:
+                    job = runner.submit(session_key, report_sql, report_params, budget=query_budget, guard=guard,
+                                        label=query_option)
+                    df = wait_for_job(job)
+                    span["rows"], span["bytes"] = len(df), frame_size(df)
+                return df
+
+            column_engine = None
+            if report_engine == "Arrow snapshot" and query_option in REPORT_VIEWS:
+                column_engine = get_arrow_engine()
+                if column_engine is None:
+                    st.caption("No current Arrow snapshot; running in SQLite.")
+            elif report_engine == "In-memory frames" and query_option in REPORT_VIEWS:
+                column_engine = get_frame_engine()
+
             try:
-                df = run_query(sql)
-                
-                if len(df) == 1 and len(df.columns) == 1:
-                    val = df.iloc[0, 0]
-                    st.metric(label="Calculated Result", value=str(val))
+                if column_engine is not None:
+                    span_name = "report_arrow" if report_engine == "Arrow snapshot" else "report_frames"
+                    with get_metrics().span(span_name, label=query_option) as span:
+                        df = column_engine.report(REPORT_VIEWS[query_option], selected_customer)
+                        span["rows"], span["bytes"] = len(df), frame_size(df)
+                    st.caption(f"{report_engine}, load generation {column_engine.generation}")
+                    if query_option in PAGED_REPORTS:
+                        page_no = st.number_input("Page", min_value=1, value=1, step=1, key=f"page-{query_option}")
+                        last = "" if page_no * PAGE_SIZE < len(df) else " (last page)"
+                        df = df.iloc[(page_no - 1) * PAGE_SIZE:page_no * PAGE_SIZE]
+                        st.caption(f"Page {page_no}{last}, {PAGE_SIZE} rows per page")
+                elif query_option in PAGED_REPORTS:
+                    pager = get_pager(sql, params, PAGED_REPORTS[query_option],
+                                      materialize=query_option in MATERIALIZED_PAGES)
+                    page_no = st.number_input("Page", min_value=1, value=1, step=1, key=f"page-{query_option}")
+                    df = pager.page(page_no - 1, run=run_report)
+                    if df.empty and page_no > 1:
+                        st.info("No more rows.")
+                    else:
+                        last = "" if pager.has_next(page_no - 1) else " (last page)"
+                        st.caption(f"Page {page_no}{last}, {PAGE_SIZE} rows per page")
                 else:
-                    st.dataframe(df, use_container_width=True, hide_index=True)
+                    df = run_report(sql, params)
+                
+                with get_metrics().span("render", label=query_option) as span:
+                    span["rows"] = len(df)
+                    if len(df) == 1 and len(df.columns) == 1:
+                        val = df.iloc[0, 0]
+                        st.metric(label="Calculated Result", value=str(val))
+                    else:
+                        st.dataframe(df, use_container_width=True, hide_index=True)
+                if df.attrs.get("guard", {}).get("truncated"):
+                    st.caption(f"Preview limited to the first {len(df):,} rows.")
+            except (QueryCancelled, QueryRejected) as e:
+                st.warning(f"Query stopped: {e}")
             except Exception as e:
                 st.error(f"Query Execution Failed: {e}")
 
+            with st.expander("⬇️ Export full result"):
+                export_format = st.radio("Format", ["csv", "parquet"], horizontal=True)
+                if st.button("Prepare export"):
+                    try:
+                        with st.spinner("Writing export..."):
+                            path = os.path.join(tempfile.gettempdir(), f"report-{session_key}.{export_format}")
+                            exported = export_query(get_pool(), sql, params, path, export_format, guard=guard)
+                        with open(path, "rb") as f:
+                            st.download_button(f"Download {exported:,} rows", f, file_name=f"report.{export_format}")
+                    except Exception as e:
+                        st.error(f"Export Failed: {e}")
+        elif "report_session" in st.session_state:
+            # Nothing to show any more; stop whatever this session left running
+            get_report_runner().cancel(st.session_state["report_session"], "superseded")
+
 
 with tab_ai:
     st.markdown(
@@ -195,40 +411,98 @@ with tab_ai:
 
             user_prompt = f"{schema_description}\n\nQuestion:\n{nl_question}\n\nSQL:"
 
-            try:
-                with st.spinner("🤖 Analyzing Schema & Generating Logic..."):
-                    response = groq_client.chat.completions.create(
-                        model="llama-3.3-70b-versatile",
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt},
-                        ],
-                        temperature=0,
-                    )
-                    sql_from_ai = response.choices[0].message.content.strip()
-
-              
-                if sql_from_ai.startswith("```"):
-                    sql_from_ai = sql_from_ai.strip("`").strip()
-                    if sql_from_ai.lower().startswith("sql"):
-                        sql_from_ai = sql_from_ai[3:].strip()
-
-                st.success("Analysis Complete")
-                
-            
-                res_col1, res_col2 = st.columns(2)
-                
-                with res_col1:
-                    st.caption("Generated SQL Query")
-                    st.code(sql_from_ai, language="sql")
-                
-                with res_col2:
-                    st.caption("Query Results")
-                    try:
-                        df_ai = run_query(sql_from_ai)
-                        st.dataframe(df_ai, use_container_width=True)
-                    except Exception as e:
-                        st.error(f"Execution Error: {e}")
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]
+            runner = get_report_runner()
+            ai_session_key = "ai-" + st.session_state.setdefault("report_session", uuid.uuid4().hex)
+            early = {}
+
+            res_col1, res_col2 = st.columns(2)
+            with res_col1:
+                st.caption("Generated SQL Query")
+                sql_box = st.empty()
+            with res_col2:
+                st.caption("Query Results")
+                result_box = st.empty()
+
+            def start_sql(sql):
+                # Runs as soon as the first complete statement has streamed in
+                early["job"] = runner.submit(ai_session_key, sql, guard=get_query_guard(), label="AI Analyst")
+
+            def translate():
+                sql, llm_timings = stream_translation(
+                    groq_client, GROQ_MODEL, messages,
+                    on_text=lambda text: sql_box.code(text, language="sql"),
+                    on_statement=start_sql,
+                )
+                early["timings"] = llm_timings
+                return sql
 
+            try:
+                started = time.perf_counter()
+                sql_from_ai, source = get_translation_cache().get_or_translate(
+                    nl_question, schema_description, GROQ_MODEL, translate
+                )
+                llm_timings = early.get("timings", {})
+                sql_box.code(sql_from_ai, language="sql")
+                get_metrics().record("groq", time.perf_counter() - started, label=source)
+                if llm_timings.get("first_token") is not None:
+                    get_metrics().record("groq_first_token", llm_timings["first_token"], label=GROQ_MODEL)
             except Exception as e:
-                st.error(f"Groq API Error: {e}")
\ No newline at end of file
+                get_metrics().record("groq", time.perf_counter() - started, label="error", ok=False)
+                st.error(f"Groq API Error: {e}")
+            else:
+                job = early.get("job")
+                if job is None or job.sql != sql_from_ai:
+                    job = runner.submit(ai_session_key, sql_from_ai, guard=get_query_guard(), label="AI Analyst")
+
+                try:
+                    with result_box.container():
+                        with st.spinner("Running generated SQL..."):
+                            df_ai = job.result()
+                    sql_seconds = job.elapsed()
+                    get_metrics().record("report", sql_seconds, label="AI Analyst", sql=sql_from_ai,
+                                         rows=len(df_ai), nbytes=frame_size(df_ai))
+                    render_started = time.perf_counter()
+                    result_box.dataframe(df_ai, use_container_width=True)
+                    render_seconds = time.perf_counter() - render_started
+                    get_metrics().record("render", render_seconds, label="AI Analyst", rows=len(df_ai))
+                    if df_ai.attrs.get("guard", {}).get("truncated"):
+                        st.caption(f"Preview limited to the first {len(df_ai):,} rows.")
+                    st.success("Analysis Complete" + (" (cached)" if source != "miss" else ""))
+                except (QueryCancelled, QueryRejected) as e:
+                    result_box.warning(f"Query stopped: {e}")
+                    sql_seconds = job.elapsed()
+                    render_seconds = 0.0
+                except Exception as e:
+                    result_box.error(f"Execution Error: {e}")
+                    sql_seconds = job.elapsed()
+                    render_seconds = 0.0
+
+                def fmt(seconds):
+                    return "-" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+                t1, t2, t3, t4, t5 = st.columns(5)
+                t1.metric("LLM first token", fmt(llm_timings.get("first_token")))
+                t2.metric("LLM total", fmt(llm_timings.get("llm_total")))
+                t3.metric("SQL", fmt(sql_seconds))
+                t4.metric("Render", fmt(render_seconds))
+                t5.metric("End to end", fmt(time.perf_counter() - started))
+
+
+if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+    with st.expander("🛠️ Admin: latency by report", expanded=True):
+        window = st.selectbox("Window", ["1 hour", "24 hours", "7 days", "All"], index=1)
+        since = {"1 hour": 3600, "24 hours": 86400, "7 days": 7 * 86400, "All": None}[window]
+        st.dataframe(get_metrics().percentiles(since), use_container_width=True, hide_index=True)
+        spans = get_metrics().spans(since)
+        if not spans.empty:
+            st.caption("Slowest SQL fingerprints")
+            slow = (spans.dropna(subset=["Fingerprint"])
+                    .groupby(["Fingerprint", "Label"], dropna=False)["Seconds"]
+                    .agg(["count", "median", "max"]).sort_values("max", ascending=False).head(20))
+            st.dataframe(slow.reset_index(), use_container_width=True, hide_index=True)
+
+get_metrics().record("rerun", time.perf_counter() - RERUN_STARTED)
@@ -0,0 +1,493 @@
+### Benchmarks
+# Usage:
+#   python benchmarks.py parse <data.tsv>
+#   python benchmarks.py dates [count]
+#   python benchmarks.py ex11
+#   python benchmarks.py memory <data.tsv> [normalized.db]
+#   python benchmarks.py generate <out.tsv> <order_lines> [seed]
+#   python benchmarks.py suite <data.tsv> [out.json] [repeat]
+#   python benchmarks.py compare <old.json> <new.json> [threshold]
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import sujal_codio_project as proj
+
+
+def _same_accumulators(a, b):
+    # Every collection the loaders read. Product sequence keys differ in form between
+    # serial ((seq, price)) and merged ((chunk, seq), price) parses, so products are
+    # compared as each name's (category, price) pairs in sequence order.
+    def products(acc):
+        return {name: [(cat, price) for cat, (_, price) in sorted(seen.items(), key=lambda kv: kv[1][0])]
+                for name, seen in acc["products"].items()}
+
+    return (a["lines"] == b["lines"]
+            and a["regions"] == b["regions"]
+            and a["countries"] == b["countries"]
+            and a["customers"] == b["customers"]
+            and a["categories"] == b["categories"]
+            and products(a) == products(b)
+            and a["orders"] == b["orders"])
+
+
+def bench_parallel_parse(data_filename, worker_counts=(1, 4, 16)):
+    # Serial parse vs the process pool parse at each worker count.
+    # Also checks that every parallel run produces the same rows as the serial one.
+    results = []
+
+    started = time.perf_counter()
+    serial = proj._accumulate_source_lines(data_filename)
+    elapsed = time.perf_counter() - started
+    results.append({"mode": "serial", "workers": 1, "seconds": round(elapsed, 4),
+                    "lines_per_sec": round(serial["lines"] / elapsed, 1), "identical": True})
+
+    for workers in worker_counts:
+        started = time.perf_counter()
+        parallel = proj.parse_source_parallel(data_filename, workers)
+        elapsed = time.perf_counter() - started
+        identical = _same_accumulators(parallel, serial)
+        results.append({"mode": "parallel", "workers": workers, "seconds": round(elapsed, 4),
+                        "lines_per_sec": round(parallel["lines"] / elapsed, 1), "identical": identical})
+
+    for r in results:
+        print(f"{r['mode']:<9} workers={r['workers']:<3} {r['seconds']:>9.3f}s "
+              f"{r['lines_per_sec']:>12.1f} lines/s  identical={r['identical']}")
+    return results
+
+
+def bench_date_normalizer(count=1_000_000, distinct_days=3650, seed=503):
+    # strptime/strftime per value vs DateNormalizer (cold cache, warm cache, batch)
+    rng = random.Random(seed)
+    start = datetime.date(2015, 1, 1)
+    pool = [(start + datetime.timedelta(days=i)).strftime('%Y%m%d') for i in range(distinct_days)]
+    pool += ['20230230', '20231301', '2023011', 'bad']
+    dates = [rng.choice(pool) for _ in range(count)]
+
+    def baseline():
+        out = []
+        for d in dates:
+            try:
+                out.append(datetime.datetime.strptime(d, '%Y%m%d').strftime('%Y-%m-%d'))
+            except ValueError:
+                out.append(None)
+        return out
+
+    def normalizer(norm):
+        out = []
+        for d in dates:
+            try:
+                out.append(norm.normalize(d))
+            except ValueError:
+                out.append(None)
+        return out
+
+    results = []
+    started = time.perf_counter()
+    expected = baseline()
+    base_seconds = time.perf_counter() - started
+    results.append(("strptime/strftime", base_seconds, True))
+
+    norm = proj.DateNormalizer()
+    started = time.perf_counter()
+    got = normalizer(norm)
+    results.append(("DateNormalizer (cold)", time.perf_counter() - started, got == expected))
+
+    started = time.perf_counter()
+    got = normalizer(norm)
+    results.append(("DateNormalizer (warm)", time.perf_counter() - started, got == expected))
+
+    started = time.perf_counter()
+    batch = proj.DateNormalizer().normalize_series(pd.Series(dates))
+    seconds = time.perf_counter() - started
+    got = [None if pd.isna(v) else v for v in batch]
+    results.append(("DateNormalizer (batch)", seconds, got == expected))
+
+    for name, seconds, identical in results:
+        print(f"{name:<24} {seconds:>8.3f}s  {base_seconds / seconds:>6.1f}x  identical={identical}")
+    return results
+
+
+def _synthetic_order_db(n_customers, orders_per_customer, seed=503):
+    # In-memory normalized database with random order dates per customer
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    for sql in [proj.REGION_TABLE_SQL, proj.COUNTRY_TABLE_SQL, proj.CUSTOMER_TABLE_SQL,
+                proj.PRODUCTCATEGORY_TABLE_SQL, proj.PRODUCT_TABLE_SQL, proj.ORDERDETAIL_TABLE_SQL]:
+        conn.execute(sql)
+    conn.execute("INSERT INTO Region (Region) VALUES ('Europe')")
+    conn.execute("INSERT INTO Country (Country, RegionID) VALUES ('Germany', 1)")
+    conn.executemany("INSERT INTO Customer (FirstName, LastName, Address, City, CountryID) VALUES (?,?,?,?,1)",
+                     [(f"First{i}", "Last", "Street", "City") for i in range(n_customers)])
+    conn.execute("INSERT INTO ProductCategory (ProductCategory, ProductCategoryDescription) VALUES ('c', 'd')")
+    conn.execute("INSERT INTO Product (ProductName, ProductUnitPrice, ProductCategoryID) VALUES ('p', 9.99, 1)")
+    start = datetime.date(2015, 1, 1)
+    rows = [(cid, 1, (start + datetime.timedelta(days=rng.randrange(3650))).isoformat(), 1)
+            for cid in range(1, n_customers + 1) for _ in range(orders_per_customer)]
+    conn.executemany("INSERT INTO OrderDetail (CustomerID, ProductID, OrderDate, QuantityOrdered) VALUES (?,?,?,?)",
+                     rows)
+    proj.create_report_indexes(conn)
+    return conn
+
+
+def bench_ex11(n_customers=200, orders_per_customer=(10, 50, 200, 800)):
+    # ex11 (correlated subquery) vs ex11_window and ex11_frame as orders per customer grow
+    runners = {
+        "ex11": lambda conn: pd.read_sql_query(proj.ex11(conn), conn),
+        "ex11_window": lambda conn: pd.read_sql_query(proj.ex11_window(conn), conn),
+        "ex11_frame": proj.ex11_frame,
+    }
+    results = []
+    for per_customer in orders_per_customer:
+        conn = _synthetic_order_db(n_customers, per_customer)
+        row = {"orders": n_customers * per_customer, "per_customer": per_customer}
+        frames = {}
+        for name, run in runners.items():
+            started = time.perf_counter()
+            frames[name] = run(conn)
+            row[name] = round(time.perf_counter() - started, 4)
+        conn.close()
+        row["identical"] = all(frames["ex11"].equals(f) for f in frames.values())
+        results.append(row)
+        print(f"{row['orders']:>8} orders ({per_customer:>4}/customer)  "
+              + "  ".join(f"{name} {row[name]:>7.3f}s" for name in runners)
+              + f"  identical={row['identical']}")
+    return results
+
+
+def _order_lines(data_filename):
+    # The (customer key, product name, order date, quantity) items the pipeline parses
+    with open(data_filename, 'r', encoding='utf-8') as f:
+        next(f)
+        for line in f:
+            cols = line.strip().split('\t')
+            if len(cols) < 11: continue
+            name_parts = cols[0].strip().split()
+            if len(name_parts) < 2: continue
+            c_key = f"{name_parts[0]} {' '.join(name_parts[1:])}"
+            for p, q, d in zip(cols[5].split(';'), cols[9].split(';'), cols[10].split(';')):
+                try:
+                    yield (c_key, p.strip(), proj.normalize_order_date(d.strip()), int(q.strip()))
+                except ValueError:
+                    continue
+
+
+def _traced_bytes(build):
+    # (result, bytes still allocated once build() returns, peak bytes while it ran)
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+
+def bench_order_memory(data_filename, db_filename=None):
+    # Memory held per order line: the list of tuples the pipeline used to keep
+    # vs OrderColumns, and (given a database) the OrderDetail frame from
+    # pd.read_sql_query vs the compact frame the in-memory report engine keeps
+    from report_engines import FRAME_TABLES, compact_frame
+
+    def columns():
+        orders = proj.OrderColumns()
+        for item in _order_lines(data_filename):
+            orders.append(*item)
+        return orders
+
+    for _ in _order_lines(data_filename):
+        pass  # warm the date normalizer cache so neither run pays for it
+    tuples, tuple_bytes, tuple_peak = _traced_bytes(lambda: list(_order_lines(data_filename)))
+    orders, column_bytes, column_peak = _traced_bytes(columns)
+    identical = list(orders) == tuples
+    n = len(tuples)
+    del tuples
+    results = [
+        {"representation": "list of tuples", "bytes": tuple_bytes, "peak_bytes": tuple_peak},
+        {"representation": "OrderColumns", "bytes": column_bytes, "peak_bytes": column_peak},
+    ]
+
+    if db_filename:
+        conn = sqlite3.connect(db_filename)
+        sql = FRAME_TABLES["OrderDetail"]
+        frame = pd.read_sql_query(sql, conn)
+        conn.close()
+        results.append({"representation": "OrderDetail read_sql_query",
+                        "bytes": int(frame.memory_usage(deep=True).sum()), "peak_bytes": None})
+        results.append({"representation": "OrderDetail compact_frame",
+                        "bytes": int(compact_frame(frame).memory_usage(deep=True).sum()), "peak_bytes": None})
+        n_frame = len(frame)
+        for r in results[2:]:
+            r["lines"] = n_frame
+
+    for r in results:
+        r.setdefault("lines", n)
+        r["bytes_per_line"] = round(r["bytes"] / r["lines"], 1) if r["lines"] else None
+        peak = f"  peak {r['peak_bytes'] / 1024 / 1024:>8.1f} MB" if r["peak_bytes"] else ""
+        print(f"{r['representation']:<28} {r['lines']:>10} lines {r['bytes'] / 1024 / 1024:>9.1f} MB "
+              f"{r['bytes_per_line']:>8.1f} B/line{peak}")
+    print(f"OrderColumns yields the same items: {identical}")
+    return results
+
+
+### Synthetic Source Data
+# Writes a TSV in the layout the stepN loaders parse: one customer per line with
+# name, address, city, country and region, followed by semicolon-separated
+# product name / category / category description / unit price / quantity /
+# YYYYMMDD order date lists (one entry per order). The same seed always gives
+# the same file. Lines are written as they are generated, so 50M order lines
+# need no more memory than 10K. A small share of dates are invalid (Feb 30) to
+# keep the loaders' skip path in the measurements.
+
+SOURCE_HEADER = ("Name\tAddress\tCity\tCountry\tRegion\tProductName\tProductCategory\t"
+                 "ProductCategoryDescription\tProductUnitPrice\tQuantityOrderded\tOrderDate")
+
+SYNTHETIC_REGIONS = {
+    "Europe": ["Germany", "France", "UK", "Spain", "Italy", "Sweden"],
+    "Asia": ["Japan", "India", "China", "Singapore"],
+    "Americas": ["USA", "Canada", "Brazil", "Mexico"],
+    "Africa": ["Nigeria", "Kenya", "South Africa"],
+    "Oceania": ["Australia", "New Zealand"],
+}
+SYNTHETIC_FIRST_NAMES = ["Ann", "Bob", "Carla", "Dev", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jon",
+                         "Kofi", "Lena", "Mateo", "Nina", "Omar", "Priya", "Quinn", "Rosa", "Sven", "Tara"]
+SYNTHETIC_LAST_NAMES = ["Smith", "Ng", "Van Dyke", "Lee", "Park", "Diaz", "Okafor", "Muller", "Rossi",
+                        "Sato", "Kumar", "Silva", "De La Cruz", "Novak", "Berg"]
+
+
+def generate_sales_tsv(path, order_lines, seed=503, n_products=500, n_categories=25,
+                       max_orders_per_line=12, bad_date_rate=0.001):
+    # Output: {"lines": source lines written, "order_lines": orders written}
+    rng = random.Random(seed)
+    categories = [(f"Category{i:03d}", f"Description of category {i}") for i in range(n_categories)]
+    products = [(f"Product{i:05d}", categories[rng.randrange(n_categories)], round(rng.uniform(0.5, 500), 2))
+                for i in range(n_products)]
+    regions = sorted(SYNTHETIC_REGIONS)
+    start = datetime.date(2015, 1, 1).toordinal()
+
+    written = 0
+    lines = 0
+    with open(path, "w", encoding="utf-8", newline="\n", buffering=1 << 20) as f:
+        f.write(SOURCE_HEADER + "\n")
+        while written < order_lines:
+            k = min(rng.randint(1, max_orders_per_line), order_lines - written)
+            region = regions[rng.randrange(len(regions))]
+            country = rng.choice(SYNTHETIC_REGIONS[region])
+            first = f"{rng.choice(SYNTHETIC_FIRST_NAMES)}{lines}"
+            name = f"{first} {rng.choice(SYNTHETIC_LAST_NAMES)}"
+            picked = [products[rng.randrange(n_products)] for _ in range(k)]
+            dates = []
+            for _ in range(k):
+                if rng.random() < bad_date_rate:
+                    dates.append(f"{rng.randint(2015, 2024)}0230")
+                else:
+                    dates.append(datetime.date.fromordinal(start + rng.randrange(3650)).strftime("%Y%m%d"))
+            f.write("\t".join([
+                name,
+                f"{rng.randint(1, 9999)} Market Street",
+                f"{country} City {rng.randrange(40)}",
+                country,
+                region,
+                ";".join(p[0] for p in picked),
+                ";".join(p[1][0] for p in picked),
+                ";".join(p[1][1] for p in picked),
+                ";".join(str(p[2]) for p in picked),
+                ";".join(str(rng.randint(1, 20)) for _ in range(k)),
+                ";".join(dates),
+            ]) + "\n")
+            written += k
+            lines += 1
+    return {"lines": lines, "order_lines": written}
+
+
+### Suite
+# Times every stepN loader (in order, building one database) and every exN
+# query against the result. Each measurement runs in a fresh spawned process so
+# peak_rss_kb belongs to that step or query alone rather than to everything
+# that ran before it. Queries are run repeat times and report the fastest run.
+# The JSON written by run_suite is what compare_results reads.
+
+SUITE_STEPS = [
+    ("step1_create_region_table", "Region"),
+    ("step2_create_region_to_regionid_dictionary", None),
+    ("step3_create_country_table", "Country"),
+    ("step4_create_country_to_countryid_dictionary", None),
+    ("step5_create_customer_table", "Customer"),
+    ("step6_create_customer_to_customerid_dictionary", None),
+    ("step7_create_productcategory_table", "ProductCategory"),
+    ("step8_create_productcategory_to_productcategoryid_dictionary", None),
+    ("step9_create_product_table", "Product"),
+    ("step10_create_product_to_productid_dictionary", None),
+    ("step11_create_orderdetail_table", "OrderDetail"),
+]
+SUITE_QUERIES = ["ex1", "ex2", "ex3", "ex4", "ex5", "ex6", "ex7", "ex8", "ex9", "ex10", "ex11"]
+
+
+def _time_step(name, table, data_filename, db_filename):
+    fn = getattr(proj, name)
+    started = time.perf_counter()
+    if table is None:
+        rows = len(fn(db_filename))
+        return proj._stage_stats(name, rows, started)
+    fn(data_filename, db_filename)
+    stats = proj._stage_stats(name, 0, started)
+    conn = sqlite3.connect(db_filename)
+    stats["rows"] = conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+    conn.close()
+    elapsed = stats["seconds"]
+    stats["rows_per_sec"] = round(stats["rows"] / elapsed, 1) if elapsed > 0 else None
+    return stats
+
+
+def _time_query(name, db_filename, customer_name, repeat):
+    conn = sqlite3.connect(db_filename)
+    fn = getattr(proj, name)
+    sql = fn(conn, customer_name) if name in ("ex1", "ex2") else fn(conn)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        df = pd.read_sql_query(sql, conn)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    conn.close()
+    return {
+        "stage": name,
+        "rows": len(df),
+        "seconds": round(best, 4),
+        "rows_per_sec": round(len(df) / best, 1) if best > 0 else None,
+        "peak_rss_kb": proj._peak_rss_kb(),
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(data_filename, out_json=None, db_filename=None, repeat=3, isolate=True):
+    # Output: the results dict (also written to out_json when given)
+    cleanup = db_filename is None
+    if db_filename is None:
+        db_filename = os.path.join(tempfile.mkdtemp(prefix="bench-"), "normalized.db")
+    if os.path.exists(db_filename):
+        os.remove(db_filename)
+
+    executor = None
+    if isolate:
+        executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                       max_tasks_per_child=1)
+
+    def call(fn, *args):
+        if executor is None:
+            return fn(*args)
+        return executor.submit(fn, *args).result()
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "source": os.path.basename(data_filename),
+            "source_bytes": os.path.getsize(data_filename),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "isolated": isolate,
+        },
+        "steps": [],
+        "queries": [],
+    }
+    try:
+        for name, table in SUITE_STEPS:
+            stats = call(_time_step, name, table, data_filename, db_filename)
+            results["steps"].append(stats)
+            print(f"{name:<62} {stats['seconds']:>9.3f}s {stats['rows']:>10} rows  {stats['peak_rss_kb']} KB")
+
+        conn = sqlite3.connect(db_filename)
+        row = conn.execute("SELECT FirstName || ' ' || LastName FROM Customer LIMIT 1").fetchone()
+        conn.close()
+        customer_name = row[0] if row else ""
+        for name in SUITE_QUERIES:
+            stats = call(_time_query, name, db_filename, customer_name, repeat)
+            results["queries"].append(stats)
+            print(f"{name:<62} {stats['seconds']:>9.3f}s {stats['rows']:>10} rows  {stats['peak_rss_kb']} KB")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cleanup:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_filename + suffix):
+                    os.remove(db_filename + suffix)
+
+    if out_json:
+        with open(out_json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare_results(old_json, new_json, threshold=0.10):
+    # Prints each stage's time change; returns the stages more than threshold slower
+    with open(old_json) as f:
+        old = json.load(f)
+    with open(new_json) as f:
+        new = json.load(f)
+    before = {r["stage"]: r for r in old["steps"] + old["queries"]}
+    regressions = []
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    for r in new["steps"] + new["queries"]:
+        prev = before.get(r["stage"])
+        if prev is None or not prev["seconds"]:
+            continue
+        change = r["seconds"] / prev["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            flag = "SLOWER"
+            regressions.append(r["stage"])
+        elif r["rows"] != prev["rows"]:
+            flag = "ROWS CHANGED"
+        print(f"{r['stage']:<62} {prev['seconds']:>9.3f}s -> {r['seconds']:>9.3f}s {change:>+8.1%}  {flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else ""
+    if name == "parse" and len(sys.argv) > 2:
+        bench_parallel_parse(sys.argv[2])
+    elif name == "dates":
+        bench_date_normalizer(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000)
+    elif name == "ex11":
+        bench_ex11()
+    elif name == "memory" and len(sys.argv) > 2:
+        bench_order_memory(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    elif name == "generate" and len(sys.argv) > 3:
+        seed = int(sys.argv[4]) if len(sys.argv) > 4 else 503
+        print(generate_sales_tsv(sys.argv[2], int(float(sys.argv[3])), seed))
+    elif name == "suite" and len(sys.argv) > 2:
+        out = sys.argv[3] if len(sys.argv) > 3 else "bench_results.json"
+        run_suite(sys.argv[2], out, repeat=int(sys.argv[4]) if len(sys.argv) > 4 else 3)
+    elif name == "compare" and len(sys.argv) > 3:
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else 0.10
+        sys.exit(1 if compare_results(sys.argv[2], sys.argv[3], threshold) else 0)
+    else:
+        print("usage: python benchmarks.py parse <data.tsv> | dates [count] | ex11 | memory <data.tsv> [db] | "
+              "generate <out.tsv> <order_lines> [seed] | suite <data.tsv> [out.json] [repeat] | "
+              "compare <old.json> <new.json> [threshold]")
+        sys.exit(1)
@@ -0,0 +1,1207 @@
+### Dashboard Backend
+# Query-side helpers for appsujal.py. Nothing in here imports streamlit, so the
+# pieces can be used (and exercised) outside a running app; appsujal.py wraps the
+# shared instances in st.cache_resource.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+### Query Result Cache
+# Streamlit re-runs the whole script on every widget change, so the same report
+# SQL is executed over and over. QueryResultCache keeps DataFrames keyed by the
+# normalized SQL text plus the bound parameters, evicts least recently used
+# entries once max_entries or max_bytes is exceeded, and drops everything when
+# the database changes. A change is detected from the file identity, PRAGMA
+# user_version (the load generation bumped by the ETL) and PRAGMA data_version
+# (which moves whenever another connection commits).
+
+_QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def normalize_sql(sql):
+    # Collapses whitespace outside string literals and drops a trailing ';'
+    parts = _QUOTED.split(sql.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class QueryResultCache:
+
+    def __init__(self, db_path, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version_conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._version = None
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _data_version(self):
+        try:
+            inode = os.stat(self.db_path).st_ino
+        except OSError:
+            inode = None
+        if inode != getattr(self, "_inode", inode):
+            # The file was replaced; the old connection would never see new data
+            self._version_conn.close()
+            self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._inode = inode
+        user_version = self._version_conn.execute("PRAGMA user_version").fetchone()[0]
+        data_version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+        return (inode, user_version, data_version)
+
+    def _check_version(self):
+        version = self._data_version()
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.bytes_held = 0
+            self._version = version
+
+    def _key(self, sql, params, tag=None):
+        return normalize_sql(sql), tuple(params or ()), tag
+
+    def get_or_run(self, sql, params, run, tag=None):
+        # Returns the cached DataFrame for (sql, params) or calls run() and caches it.
+        # tag separates results of the same SQL produced differently (e.g. guarded previews).
+        # Cached frames are shared between sessions and must not be modified.
+        key = self._key(sql, params, tag)
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        df = run()
+        size = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self._lock:
+            self._check_version()
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (df, size)
+                self.bytes_held += size
+                while len(self._entries) > self.max_entries or self.bytes_held > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.bytes_held -= evicted
+                    self.evictions += 1
+        return df
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_held = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes_held,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+### Read-Only Connection Pool
+# Every Streamlit session runs on its own thread, so one shared connection makes
+# concurrent users queue behind each other. The pool hands each thread its own
+# read-only connection (mode=ro URI, so a stray write fails instead of taking
+# the write lock; WAL readers never block each other or the loader). A nested
+# checkout on the same thread reuses the connection it already holds.
+# query_timeout is enforced with a progress handler, acquire_timeout bounds how
+# long a thread waits for a free connection, and busy_timeout is sqlite's own
+# lock wait. A connection whose database file has been replaced (a fresh ETL
+# run) is reopened on checkout.
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ReadOnlyConnectionPool:
+
+    def __init__(self, db_path, max_size=8, acquire_timeout=10.0, query_timeout=30.0, busy_timeout=5.0):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.query_timeout = query_timeout
+        self.busy_timeout = busy_timeout
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.acquire_timeouts = 0
+        self.query_timeouts = 0
+        self.reopened = 0
+
+    def _inode(self):
+        try:
+            return os.stat(self.db_path).st_ino
+        except OSError:
+            return None
+
+    def _open(self):
+        uri = "file:" + os.path.abspath(self.db_path) + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout, check_same_thread=False)
+        return conn, self._inode()
+
+    def _acquire(self):
+        started = time.perf_counter()
+        with self._cond:
+            waited = False
+            while not self._idle and self._created >= self.max_size:
+                waited = True
+                remaining = self.acquire_timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    self.acquire_timeouts += 1
+                    raise PoolTimeout(f"no connection free after {self.acquire_timeout}s "
+                                      f"({self.max_size} in use)")
+                self._cond.wait(remaining)
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.perf_counter() - started
+            entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                self._created += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.checkouts += 1
+
+        try:
+            if entry is None:
+                entry = self._open()
+            elif entry[1] != self._inode():
+                entry[0].close()
+                entry = self._open()
+                with self._cond:
+                    self.reopened += 1
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+        return entry
+
+    def _release(self, entry):
+        entry[0].set_progress_handler(None, 0)
+        if entry[0].in_transaction:
+            entry[0].rollback()
+        with self._cond:
+            self._idle.append(entry)
+            self.in_use -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, query_timeout=None):
+        # query_timeout overrides the pool default for this checkout (0 disables it)
+        held = getattr(self._local, "entry", None)
+        if held is not None:
+            yield held[0]
+            return
+
+        entry = self._acquire()
+        conn = entry[0]
+        timed_out = []
+        if query_timeout is None:
+            query_timeout = self.query_timeout
+        if query_timeout:
+            deadline = time.perf_counter() + query_timeout
+
+            def over_budget():
+                # Called every 10k VM instructions; a non-zero return aborts the statement
+                if time.perf_counter() > deadline:
+                    timed_out.append(True)
+                    return 1
+                return 0
+
+            conn.set_progress_handler(over_budget, 10000)
+        self._local.entry = entry
+        try:
+            yield conn
+        finally:
+            if timed_out:
+                with self._cond:
+                    self.query_timeouts += 1
+            self._local.entry = None
+            self._release(entry)
+
+    def read_sql(self, sql, params=()):
+        with self.connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def close(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                conn.close()
+            self._created -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._created,
+                "max_size": self.max_size,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "avg_wait_ms": round(1000 * self.wait_seconds / self.waits, 2) if self.waits else 0.0,
+                "acquire_timeouts": self.acquire_timeouts,
+                "query_timeouts": self.query_timeouts,
+                "reopened": self.reopened,
+            }
+
+
+### Background Report Runner
+# Report queries run on a small thread pool instead of the script thread, so the
+# page can show progress while they work. Jobs are keyed by the session that
+# submitted them: submitting again for the same key cancels the previous job
+# (Connection.interrupt() aborts the statement in flight), so a user who
+# switches reports does not wait for, or pay for, the one they left. Each job
+# also gets a wall-clock budget enforced by a timer that interrupts it the same
+# way.
+
+class QueryCancelled(Exception):
+    pass
+
+
+class ReportJob:
+
+    def __init__(self, sql, params, budget, guard=None, label=None):
+        self.sql = sql
+        self.params = tuple(params or ())
+        self.budget = budget
+        self.guard = guard
+        self.label = label
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.cancel_reason = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _attach(self, conn):
+        with self._lock:
+            if self.cancel_reason:
+                raise QueryCancelled(self.cancel_reason)
+            self._conn = conn
+
+    def _detach(self):
+        with self._lock:
+            self._conn = None
+
+    def cancel(self, reason="cancelled"):
+        # Safe from any thread; only interrupts while the job holds its connection
+        with self._lock:
+            if self.cancel_reason or self.done():
+                return False
+            self.cancel_reason = reason
+            if self._conn is not None:
+                self._conn.interrupt()
+        if self.future is not None:
+            self.future.cancel()
+        return True
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def elapsed(self):
+        end = self.finished or time.perf_counter()
+        return end - (self.started or self.submitted)
+
+    def result(self, timeout=None):
+        try:
+            return self.future.result(timeout)
+        except CancelledError:
+            raise QueryCancelled(self.cancel_reason or "cancelled") from None
+
+
+class ReportRunner:
+
+    def __init__(self, pool, cache=None, max_workers=4, default_budget=60.0, metrics=None):
+        self.pool = pool
+        self.cache = cache
+        self.default_budget = default_budget
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.superseded = 0
+        self.over_budget = 0
+
+    def _execute(self, job):
+        # The job's own budget timer replaces the pool's per-checkout timeout.
+        # With metrics, the time SQLite spends on the statement (not the wait in
+        # the queue, nor a cache hit) is recorded as a "query" span.
+        if self.metrics is None:
+            return self._query(job, {})
+        with self.metrics.span("query", job.label, job.sql) as span:
+            return self._query(job, span)
+
+    def _query(self, job, span):
+        with self.pool.connection(query_timeout=0) as conn:
+            job._attach(conn)
+            try:
+                if job.guard is not None:
+                    df = job.guard.run(conn, job.sql, job.params)
+                else:
+                    df = pd.read_sql_query(job.sql, conn, params=job.params)
+                span["rows"], span["bytes"] = len(df), frame_size(df)
+                return df
+            except Exception as e:
+                if job.cancel_reason:
+                    raise QueryCancelled(job.cancel_reason) from e
+                raise
+            finally:
+                job._detach()
+
+    def _run(self, job):
+        job.started = time.perf_counter()
+        timer = None
+        if job.budget:
+            timer = threading.Timer(job.budget, self._expire, (job,))
+            timer.daemon = True
+            timer.start()
+        try:
+            if job.cancel_reason:
+                raise QueryCancelled(job.cancel_reason)
+            if self.cache is not None:
+                tag = "guarded" if job.guard is not None else None
+                return self.cache.get_or_run(job.sql, job.params, lambda: self._execute(job), tag)
+            return self._execute(job)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            job.finished = time.perf_counter()
+
+    def _expire(self, job):
+        if job.cancel(f"exceeded {job.budget:g}s budget"):
+            with self._lock:
+                self.over_budget += 1
+
+    def submit(self, key, sql, params=(), budget=None, guard=None, label=None):
+        # Starts sql in the background and cancels whatever key was running before.
+        # With a QueryGuard the statement runs as a bounded preview (see Guarded Execution).
+        # label names the job's "query" span.
+        job = ReportJob(sql, params, self.default_budget if budget is None else budget, guard, label)
+        with self._lock:
+            previous = self._jobs.get(key)
+            self._jobs[key] = job
+            self.submitted += 1
+        if previous is not None and previous.cancel("superseded"):
+            with self._lock:
+                self.superseded += 1
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def current(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def cancel(self, key, reason="cancelled"):
+        with self._lock:
+            job = self._jobs.pop(key, None)
+        return job.cancel(reason) if job is not None else False
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if not job.done())
+            return {
+                "submitted": self.submitted,
+                "running": running,
+                "superseded": self.superseded,
+                "over_budget": self.over_budget,
+            }
+
+
+### NL to SQL Translation Cache
+# The AI Analyst tab asks Groq to turn a question into SQL with temperature=0,
+# so the same question against the same schema and model gives the same SQL.
+# TranslationCache keeps those answers in a small SQLite file of its own (the
+# sales database is opened read-only and rebuilt by the ETL), keyed by a hash of
+# the normalized question, the schema description and the model name. Entries
+# older than ttl seconds are ignored and replaced. Identical questions that
+# arrive while a translation is already in flight wait for that call instead of
+# starting another one.
+
+TRANSLATION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS Translation (
+    CacheKey TEXT NOT NULL PRIMARY KEY,
+    Question TEXT NOT NULL,
+    Model TEXT NOT NULL,
+    SchemaHash TEXT NOT NULL,
+    SQL TEXT NOT NULL,
+    CreatedAt REAL NOT NULL,
+    LastUsedAt REAL NOT NULL,
+    Hits INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+
+def normalize_question(question):
+    # Case, runs of whitespace and trailing punctuation do not change the answer
+    return re.sub(r"\s+", " ", question).strip().rstrip("?.!; ").lower()
+
+
+def schema_hash(schema_description):
+    text = "\n".join(line.strip() for line in schema_description.strip().splitlines())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+# Handed to coalesced waiters when the owner of a translation is interrupted.
+_RETRY_TRANSLATION = object()
+
+
+class TranslationCache:
+
+    def __init__(self, cache_path="nl2sql_cache.db", ttl=7 * 24 * 3600):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(TRANSLATION_TABLE_SQL)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expired = 0
+
+    def key(self, question, schema_description, model):
+        parts = [normalize_question(question), schema_hash(schema_description), model]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def _lookup(self, key):
+        row = self._conn.execute(
+            "SELECT SQL, CreatedAt FROM Translation WHERE CacheKey = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if self.ttl and time.time() - row[1] > self.ttl:
+            self.expired += 1
+            return None
+        self._conn.execute(
+            "UPDATE Translation SET Hits = Hits + 1, LastUsedAt = ? WHERE CacheKey = ?",
+            (time.time(), key),
+        )
+        self._conn.commit()
+        return row[0]
+
+    def _store(self, key, question, schema_description, model, sql):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO Translation "
+                "(CacheKey, Question, Model, SchemaHash, SQL, CreatedAt, LastUsedAt, Hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, normalize_question(question), model, schema_hash(schema_description), sql, now, now),
+            )
+            self._conn.commit()
+
+    def get_or_translate(self, question, schema_description, model, translate):
+        # Returns (sql, source) where source is "hit", "coalesced" or "miss".
+        # translate() is only called on a miss and must return the final SQL text.
+        key = self.key(question, schema_description, model)
+        while True:
+            with self._lock:
+                sql = self._lookup(key)
+                if sql is not None:
+                    self.hits += 1
+                    return sql, "hit"
+                waiting = self._in_flight.get(key)
+                if waiting is None:
+                    waiting = Future()
+                    self._in_flight[key] = waiting
+                    owner = True
+                    self.misses += 1
+                else:
+                    owner = False
+                    self.coalesced += 1
+
+            if owner:
+                break
+            sql = waiting.result()
+            if sql is not _RETRY_TRANSLATION:
+                return sql, "coalesced"
+            # The owner was interrupted (KeyboardInterrupt, SystemExit, a Streamlit rerun):
+            # that belongs to its own session, so waiters go round again and one of them
+            # takes over the translation.
+
+        try:
+            sql = translate()
+            self._store(key, question, schema_description, model, sql)
+            waiting.set_result(sql)
+            return sql, "miss"
+        except Exception as e:
+            waiting.set_exception(e)
+            raise
+        except BaseException:
+            self._release(key, waiting)
+            waiting.set_result(_RETRY_TRANSLATION)
+            raise
+        finally:
+            self._release(key, waiting)
+
+    def _release(self, key, waiting):
+        # Only drop our own entry; after an interrupted owner a waiter may already own a new one.
+        with self._lock:
+            if self._in_flight.get(key) is waiting:
+                del self._in_flight[key]
+
+    def purge_expired(self):
+        if not self.ttl:
+            return 0
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM Translation WHERE CreatedAt < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            stored = self._conn.execute("SELECT COUNT(*) FROM Translation").fetchone()[0]
+            return {
+                "entries": stored,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "expired": self.expired,
+                "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+            }
+
+
+### Streaming NL to SQL
+# With stream=True the chat completion arrives as deltas. SQLStreamParser
+# accumulates them and reports the moment the first complete SQL statement is
+# available (sqlite3.complete_statement, or a closing ``` fence), so the caller
+# can start running it while the rest of the answer is still arriving.
+# stream_translation drives one streamed completion and records where the time
+# went. FakeGroqClient mimics the parts of the Groq client the dashboard uses,
+# streaming canned SQL with configurable delays, for running the app and
+# checking the streaming path without an API key.
+
+def clean_sql_response(text):
+    # Strips markdown fences (and a leading "sql" language tag) from a model answer
+    sql = text.strip()
+    if sql.startswith("```"):
+        sql = sql[3:]
+        if sql[:3].lower() == "sql":
+            sql = sql[3:]
+        sql = sql.split("```", 1)[0]
+    return sql.strip()
+
+
+class SQLStreamParser:
+
+    def __init__(self):
+        self.raw = ""
+        self.statement = None
+
+    def text(self):
+        return clean_sql_response(self.raw)
+
+    def feed(self, delta):
+        # Returns True exactly once, when the first complete statement is known
+        self.raw += delta
+        if self.statement is not None:
+            return False
+        sql = self.text()
+        fenced = self.raw.lstrip().startswith("```") and self.raw.count("```") >= 2
+        if fenced or (sql and sqlite3.complete_statement(sql)):
+            self.statement = sql
+            return True
+        return False
+
+    def finish(self):
+        if self.statement is None:
+            self.statement = self.text()
+            return bool(self.statement)
+        return False
+
+
+def stream_translation(client, model, messages, on_text=None, on_statement=None):
+    # Returns (sql, timings); timings are seconds from the request being sent
+    parser = SQLStreamParser()
+    timings = {"first_token": None, "statement": None, "llm_total": None}
+    started = time.perf_counter()
+    stream = client.chat.completions.create(model=model, messages=messages, temperature=0, stream=True)
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content or ""
+        if not delta:
+            continue
+        if timings["first_token"] is None:
+            timings["first_token"] = time.perf_counter() - started
+        found = parser.feed(delta)
+        if on_text is not None:
+            on_text(parser.text())
+        if found:
+            timings["statement"] = time.perf_counter() - started
+            if on_statement is not None:
+                on_statement(parser.statement)
+    if parser.finish():
+        timings["statement"] = time.perf_counter() - started
+        if on_statement is not None:
+            on_statement(parser.statement)
+    timings["llm_total"] = time.perf_counter() - started
+    return parser.statement, timings
+
+
+class FakeGroqClient:
+
+    DEFAULT_SQL = (
+        "SELECT ProductName, ProductUnitPrice\n"
+        "FROM Product\n"
+        "ORDER BY ProductUnitPrice DESC\n"
+        "LIMIT 5;"
+    )
+
+    def __init__(self, responses=None, first_token_delay=0.3, token_delay=0.02, trailer=""):
+        # responses maps a lower-case substring of the question to the SQL to answer with
+        self.responses = responses or {}
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.trailer = trailer
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _answer(self, messages):
+        question = messages[-1]["content"].lower()
+        for needle, sql in self.responses.items():
+            if needle in question:
+                return "```sql\n" + sql + "\n```" + self.trailer
+        return "```sql\n" + self.DEFAULT_SQL + "\n```" + self.trailer
+
+    def _create(self, model, messages, temperature=0, stream=False, **kwargs):
+        self.calls += 1
+        answer = self._answer(messages)
+        if not stream:
+            time.sleep(self.first_token_delay + self.token_delay * len(answer.split()))
+            message = SimpleNamespace(content=answer)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        return self._stream(answer)
+
+    def _stream(self, answer):
+        time.sleep(self.first_token_delay)
+        for token in re.findall(r"\S+\s*|\s+", answer):
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+            time.sleep(self.token_delay)
+
+
+### Guarded Execution
+# SQL typed into "Custom SQL Query" or produced by the AI Analyst is not known in
+# advance, and one accidental cross join can pin a core and buffer millions of
+# rows. QueryGuard runs such statements on a read-only connection and stops
+# them at several points:
+#   - EXPLAIN QUERY PLAN first; a table read without an index (explain_report_queries'
+#     FULL SCAN) is rejected when it holds more than max_table_scan rows, and
+#     several such tables when their sizes multiply out to more than
+#     max_scan_rows, i.e. nested loops of full scans. Sizes come from
+#     sqlite_stat1 when ANALYZE has run, else MAX(rowid)
+#   - the statement is wrapped in SELECT * FROM (...) LIMIT preview_limit + 1
+#     so SQLite can stop early, and the extra row shows the preview was cut
+#   - a progress handler aborts after instruction_budget VM instructions
+#   - rows are pulled with fetchmany and never more than max_rows are kept
+# The outcome is recorded in df.attrs["guard"].
+
+class QueryRejected(Exception):
+    pass
+
+
+class QueryGuard:
+
+    def __init__(self, max_rows=10000, preview_limit=1000, instruction_budget=50_000_000,
+                 max_scan_rows=1_000_000, max_table_scan=500_000, fetch_size=1000):
+        self.max_rows = max_rows
+        self.preview_limit = preview_limit
+        self.instruction_budget = instruction_budget
+        self.max_scan_rows = max_scan_rows
+        self.max_table_scan = max_table_scan
+        self.fetch_size = fetch_size
+
+    def prepare(self, sql):
+        # Returns the statement wrapped for preview, or raises QueryRejected.
+        # A second statement makes the wrapped SQL fail to plan, so it is rejected there.
+        body = sql.strip().rstrip(";").strip()
+        if not body:
+            raise QueryRejected("empty statement")
+        first = body.split(None, 1)[0].upper()
+        if first not in ("SELECT", "WITH", "VALUES"):
+            raise QueryRejected(f"only SELECT statements can be run here, not {first}")
+        limit = self.preview_limit if self.preview_limit else self.max_rows
+        return f"SELECT * FROM (\n{body}\n) LIMIT {int(limit) + 1}"
+
+    @staticmethod
+    def table_rows(conn, table):
+        # Row estimate for table: the leading sqlite_stat1 count, else MAX(rowid), else None
+        try:
+            stats = conn.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = ?", (table,)).fetchall()
+        except sqlite3.Error:
+            stats = []
+        counts = [int(s.split()[0]) for (s,) in stats if s and s.split()[0].isdigit()]
+        if counts:
+            return max(counts)
+        try:
+            return conn.execute("SELECT MAX(rowid) FROM %s" % table).fetchone()[0] or 0
+        except sqlite3.Error:
+            return None
+
+    def check_plan(self, conn, sql, params=()):
+        # Returns the plan DataFrame; raises QueryRejected for large or nested full scans
+        from sujal_codio_project import explain_report_queries
+
+        plan = explain_report_queries(conn, {"guarded": (sql, params)}, min_rows=1)
+        scanned = plan.loc[plan["Flag"] == "FULL SCAN", "Table"].tolist()
+        sizes = [self.table_rows(conn, table) for table in scanned]
+        for table, rows in zip(scanned, sizes):
+            if rows is not None and rows > self.max_table_scan:
+                raise QueryRejected(
+                    f"plan reads all of {table} without an index "
+                    f"(about {rows:,} rows, limit {self.max_table_scan:,}); add a filter on an indexed column"
+                )
+        if len(scanned) > 1:
+            estimate = 1
+            for rows in sizes:
+                estimate *= 1000 if rows is None else rows or 1
+            if estimate > self.max_scan_rows:
+                raise QueryRejected(
+                    f"plan scans {' x '.join(scanned)} without an index "
+                    f"(about {estimate:,} row combinations, limit {self.max_scan_rows:,})"
+                )
+        return plan
+
+    def run(self, conn, sql, params=()):
+        wrapped = self.prepare(sql)
+        try:
+            plan = self.check_plan(conn, wrapped, params)
+        except sqlite3.Error as e:
+            raise QueryRejected(f"could not plan statement: {e}") from e
+
+        step = 1000
+        counter = {"steps": 0}
+
+        def over_budget():
+            counter["steps"] += 1
+            return counter["steps"] * step > self.instruction_budget
+
+        conn.set_progress_handler(over_budget, step)
+        try:
+            cur = conn.execute(wrapped, params)
+            columns = [d[0] for d in cur.description]
+            rows = []
+            while len(rows) <= self.max_rows:
+                batch = cur.fetchmany(self.fetch_size)
+                if not batch:
+                    break
+                rows.extend(batch)
+            cur.close()
+        except sqlite3.OperationalError as e:
+            if counter["steps"] * step > self.instruction_budget:
+                raise QueryRejected(
+                    f"stopped after {self.instruction_budget:,} instructions; narrow the query or add a filter"
+                ) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+        keep = min(self.max_rows, self.preview_limit or self.max_rows)
+        df = pd.DataFrame(rows[:keep], columns=columns)
+        df.attrs["guard"] = {
+            "truncated": len(rows) > keep,
+            "rows": len(df),
+            "instructions": counter["steps"] * step,
+            "plan": plan["Detail"].tolist(),
+        }
+        return df
+
+
+### Paginated Results
+# Large reports are shown a page at a time instead of being materialized in
+# full per session. KeysetPager wraps the report SQL and asks for rows after the
+# last key of the previous page (WHERE key > last ORDER BY key LIMIT n), so every
+# page costs the same no matter how deep the user goes, unlike OFFSET. Each
+# fetch reads the requested page plus prefetch_pages more, remembers where every
+# fetched page ends, and keeps a handful of pages in an LRU. Fetches are short
+# statements on pooled connections rather than a cursor held open across
+# reruns, which would pin a read transaction and stall WAL checkpoints.
+#
+# key is a list of result columns, each a name (ascending) or (name, "DESC"),
+# and must identify rows uniquely and contain no NULLs; add a tie breaker such
+# as a name or id column when the sort column can repeat.
+#
+# A keyset WHERE on top of an aggregate report (ex3, ex8) still makes SQLite
+# run the whole GROUP BY for every page. For those, materialize=True fetches the
+# full result with run(sql, params) and takes the same keyset window from it in
+# pandas. Pass a run that goes through the shared QueryResultCache (as
+# ReportRunner does) so the aggregate is computed once for all sessions and
+# pages; the pager itself still keeps only its page LRU.
+
+class KeysetPager:
+
+    def __init__(self, pool, sql, params=(), key=(), page_size=100, prefetch_pages=2, max_cached_pages=8,
+                 materialize=False):
+        if not key:
+            raise ValueError("KeysetPager needs at least one key column")
+        self.pool = pool
+        self.sql = sql.strip().rstrip(";")
+        self.params = tuple(params or ())
+        self.key = [(k, "ASC") if isinstance(k, str) else (k[0], k[1].upper()) for k in key]
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.max_cached_pages = max_cached_pages
+        self.materialize = materialize
+        self.last_page = None
+        self.fetches = 0
+        self._ends = {}
+        self._pages = OrderedDict()
+        self._total = None
+
+    @staticmethod
+    def _quote(column):
+        return '"' + column.replace('"', '""') + '"'
+
+    def _after(self, last):
+        # (k1 > ?) OR (k1 = ? AND k2 > ?) OR ... with each column's own direction
+        terms, params = [], []
+        for i, (column, direction) in enumerate(self.key):
+            parts = []
+            for prev, _ in self.key[:i]:
+                parts.append(f"{self._quote(prev)} = ?")
+            parts.append(f"{self._quote(column)} {'<' if direction == 'DESC' else '>'} ?")
+            terms.append("(" + " AND ".join(parts) + ")")
+            params.extend(last[:i + 1])
+        return " OR ".join(terms), params
+
+    def page_query(self, page):
+        # (sql, params) fetching page and the prefetch window after it;
+        # needs the end key of page - 1, so pages are reached in order
+        order = ", ".join(f"{self._quote(c)} {d}" for c, d in self.key)
+        sql = f"SELECT * FROM (\n{self.sql}\n)"
+        params = list(self.params)
+        if page > 0:
+            where, extra = self._after(self._ends[page - 1])
+            sql += f" WHERE {where}"
+            params += extra
+        sql += f" ORDER BY {order} LIMIT {self.page_size * (self.prefetch_pages + 1)}"
+        return sql, tuple(params)
+
+    def _default_run(self, sql, params):
+        return self.pool.read_sql(sql, params)
+
+    def _materialized_window(self, start, run):
+        # The page_query window, taken from the full result instead of from SQLite
+        df = run(self.sql, self.params)
+        self._total = len(df)
+        columns = [c for c, _ in self.key]
+        df = df.sort_values(columns, ascending=[d == "ASC" for _, d in self.key], kind="stable")
+        if start > 0:
+            last = self._ends[start - 1]
+            after = pd.Series(False, index=df.index)
+            for i, (column, direction) in enumerate(self.key):
+                term = df[column] < last[i] if direction == "DESC" else df[column] > last[i]
+                for prev, value in zip(columns[:i], last):
+                    term &= df[prev] == value
+                after |= term
+            df = df[after]
+        return df.head(self.page_size * (self.prefetch_pages + 1))
+
+    def _fetch(self, start, run):
+        if self.materialize:
+            df = self._materialized_window(start, run)
+        else:
+            sql, params = self.page_query(start)
+            df = run(sql, params)
+        self.fetches += 1
+        columns = [c for c, _ in self.key]
+        if df.empty and start > 0:
+            self.last_page = start - 1
+            return
+        for i in range(0, max(len(df), 1), self.page_size):
+            chunk = df.iloc[i:i + self.page_size].reset_index(drop=True)
+            page = start + i // self.page_size
+            self._pages[page] = chunk
+            self._pages.move_to_end(page)
+            if len(chunk):
+                # numpy scalars would be bound as blobs; compare on plain Python values
+                last = chunk.iloc[-1][columns].tolist()
+                self._ends[page] = tuple(v.item() if hasattr(v, "item") else v for v in last)
+            if len(chunk) < self.page_size:
+                self.last_page = page
+                break
+        while len(self._pages) > self.max_cached_pages:
+            self._pages.popitem(last=False)
+
+    def page(self, page, run=None):
+        # Returns the DataFrame for page (0-based); empty past the end.
+        # run(sql, params) -> DataFrame executes the fetch, defaulting to the pool.
+        run = run or self._default_run
+        if self.last_page is not None and page > self.last_page:
+            return self._pages.get(self.last_page, pd.DataFrame()).iloc[0:0]
+        while page not in self._pages:
+            known = [p for p in self._ends if p < page]
+            start = max(known) + 1 if known else 0
+            if self.last_page is not None and start > self.last_page:
+                return pd.DataFrame()
+            self._fetch(start, run)
+            if self.last_page is not None and page > self.last_page:
+                return self._pages.get(self.last_page, pd.DataFrame()).iloc[0:0]
+        self._pages.move_to_end(page)
+        return self._pages[page]
+
+    def has_next(self, page):
+        return self.last_page is None or page < self.last_page
+
+    def total_rows(self):
+        if self._total is None:
+            df = self.pool.read_sql(f"SELECT COUNT(*) FROM (\n{self.sql}\n)", self.params)
+            self._total = int(df.iloc[0, 0])
+        return self._total
+
+
+### Chunked Export
+# Writes a full query result to CSV or Parquet chunk_size rows at a time, so an
+# export never holds more than one chunk in memory. A QueryGuard, when given, still vets the
+# plan (nested large scans are refused) but its row caps do not apply.
+
+def export_query(pool, sql, params, path, fmt="csv", chunk_size=50000, guard=None, query_timeout=None):
+    # Returns the number of rows written. The export runs under the pool's query
+    # timeout (query_timeout overrides it) and, with a guard, the guard's
+    # instruction budget; either one stops it with QueryRejected and the partial
+    # file is removed. A connection has one progress handler, so a single
+    # handler here checks both.
+    if query_timeout is None:
+        query_timeout = pool.query_timeout
+    with pool.connection(query_timeout=0) as conn:
+        if guard is not None:
+            guard.prepare(sql)
+            guard.check_plan(conn, sql.strip().rstrip(";"), params)
+
+        step = 1000
+        counter = {"steps": 0}
+        deadline = time.perf_counter() + query_timeout if query_timeout else None
+        budget = guard.instruction_budget if guard is not None else None
+
+        def over_budget():
+            counter["steps"] += 1
+            if budget and counter["steps"] * step > budget:
+                return 1
+            return 1 if deadline is not None and time.perf_counter() > deadline else 0
+
+        conn.set_progress_handler(over_budget, step)
+        try:
+            return _write_export(conn, sql, params, path, fmt, chunk_size)
+        except sqlite3.OperationalError as e:
+            if os.path.exists(path):
+                os.remove(path)
+            if budget and counter["steps"] * step > budget:
+                raise QueryRejected(
+                    f"export stopped after {budget:,} instructions; narrow the query or add a filter") from e
+            if deadline is not None and time.perf_counter() > deadline:
+                raise QueryRejected(f"export stopped after {query_timeout:g}s") from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+
+def _write_export(conn, sql, params, path, fmt, chunk_size):
+    cur = conn.execute(sql, params)
+    columns = [d[0] for d in cur.description]
+    rows = 0
+
+    if fmt == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            pd.DataFrame(columns=columns).to_csv(f, index=False)
+            while True:
+                batch = cur.fetchmany(chunk_size)
+                if not batch:
+                    break
+                pd.DataFrame(batch, columns=columns).to_csv(f, index=False, header=False)
+                rows += len(batch)
+    elif fmt == "parquet":
+        # A column that is NULL throughout a chunk comes out typed null, and the
+        # writer's schema is fixed when it opens, so chunks are held back until
+        # every column has shown a type. Columns still untyped after
+        # max_pending rows (or at the end) are written as strings.
+        max_pending = 10 * chunk_size
+        writer = None
+        pending = []
+        try:
+            while True:
+                batch = cur.fetchmany(chunk_size)
+                if batch:
+                    arrays = [pa.array(values) for values in zip(*batch)]
+                    pending.append(pa.Table.from_arrays(arrays, names=columns))
+                    rows += len(batch)
+                if writer is None and pending:
+                    schema = pa.unify_schemas([t.schema for t in pending], promote_options="permissive")
+                    if batch and rows < max_pending and any(pa.types.is_null(f.type) for f in schema):
+                        continue
+                    writer = pq.ParquetWriter(path, pa.schema(
+                        [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in schema]))
+                for table in pending:
+                    writer.write_table(table.cast(writer.schema))
+                pending = []
+                if not batch:
+                    break
+            if writer is None:
+                pq.write_table(pa.Table.from_pandas(pd.DataFrame(columns=columns), preserve_index=False), path)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        raise ValueError(f"unknown export format: {fmt}")
+    cur.close()
+    return rows
+
+
+### Instrumentation
+# Timing spans for the dashboard's hot paths (script rerun, customer search,
+# report queries, the Groq call, rendering). Each span records its duration and,
+# where it applies, a fingerprint of the SQL (literals replaced by ?, so the
+# same report with different values groups together), the row count and the
+# result size in bytes. Spans are buffered in memory and flushed in batches to
+# a SQLite file of their own, which is trimmed to the newest max_rows spans.
+# percentiles() summarizes them per span and label for the admin panel.
+
+SPAN_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS Span (
+    SpanID INTEGER PRIMARY KEY AUTOINCREMENT,
+    At REAL NOT NULL,
+    Name TEXT NOT NULL,
+    Label TEXT,
+    Fingerprint TEXT,
+    Seconds REAL NOT NULL,
+    Rows INTEGER,
+    Bytes INTEGER,
+    Ok INTEGER NOT NULL
+);
+"""
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def sql_fingerprint(sql):
+    text = _LITERALS.sub("?", normalize_sql(sql)).lower()
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def frame_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class MetricsStore:
+
+    def __init__(self, path="dashboard_metrics.db", max_rows=200000, flush_every=50, flush_seconds=5.0):
+        self.path = path
+        self.max_rows = max_rows
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SPAN_TABLE_SQL)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_Span_Name_At ON Span (Name, At)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_flush = time.perf_counter()
+        self._since_trim = 0
+
+    def record(self, name, seconds, label=None, sql=None, rows=None, nbytes=None, ok=True):
+        row = (time.time(), name, label, sql_fingerprint(sql) if sql else None,
+               seconds, rows, nbytes, int(bool(ok)))
+        with self._lock:
+            self._pending.append(row)
+            due = (len(self._pending) >= self.flush_every
+                   or time.perf_counter() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    @contextmanager
+    def span(self, name, label=None, sql=None):
+        # The yielded dict takes optional "rows", "bytes" and "sql" set by the caller
+        info = {"sql": sql}
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield info
+            ok = True
+        finally:
+            self.record(name, time.perf_counter() - started, label, info.get("sql"),
+                        info.get("rows"), info.get("bytes"), ok)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.perf_counter()
+            if not pending:
+                return
+            self._conn.executemany(
+                "INSERT INTO Span (At, Name, Label, Fingerprint, Seconds, Rows, Bytes, Ok) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", pending)
+            self._since_trim += len(pending)
+            if self._since_trim >= self.max_rows // 10:
+                self._conn.execute(
+                    "DELETE FROM Span WHERE SpanID <= (SELECT MAX(SpanID) FROM Span) - ?", (self.max_rows,))
+                self._since_trim = 0
+            self._conn.commit()
+
+    def spans(self, since_seconds=None):
+        self.flush()
+        sql = "SELECT At, Name, Label, Fingerprint, Seconds, Rows, Bytes, Ok FROM Span"
+        params = ()
+        if since_seconds:
+            sql += " WHERE At >= ?"
+            params = (time.time() - since_seconds,)
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def percentiles(self, since_seconds=None):
+        # One row per (Name, Label): count, error count, p50/p95/p99 and max in ms
+        df = self.spans(since_seconds)
+        columns = ["Name", "Label", "Count", "Errors", "p50_ms", "p95_ms", "p99_ms", "max_ms", "avg_rows"]
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        df["Label"] = df["Label"].fillna("")
+        grouped = df.groupby(["Name", "Label"])
+        out = grouped["Seconds"].quantile([0.5, 0.95, 0.99]).unstack() * 1000
+        out.columns = ["p50_ms", "p95_ms", "p99_ms"]
+        out["max_ms"] = grouped["Seconds"].max() * 1000
+        out["Count"] = grouped.size()
+        out["Errors"] = grouped["Ok"].apply(lambda s: int((s == 0).sum()))
+        out["avg_rows"] = grouped["Rows"].mean()
+        out = out.reset_index()[columns].round(1)
+        return out.sort_values("p95_ms", ascending=False, ignore_index=True)
@@ -0,0 +1,37 @@
+### Query Plan Advisor
+# Runs EXPLAIN QUERY PLAN for every exN report query and flags full table scans.
+# Usage: python query_advisor.py [normalized.db] [--create-indexes]
+# Exits with status 1 when any query still full-scans a table.
+import sys
+
+import pandas as pd
+
+from sujal_codio_project import create_connection, create_report_indexes, explain_report_queries
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith("--")]
+    db_file = args[0] if args else "normalized.db"
+
+    conn = create_connection(db_file)
+    if "--create-indexes" in argv:
+        print("Created indexes:", ", ".join(create_report_indexes(conn)))
+
+    plans = explain_report_queries(conn)
+    conn.close()
+
+    with pd.option_context("display.max_rows", None, "display.max_colwidth", 80, "display.width", 160):
+        print(plans.to_string(index=False))
+
+    flagged = plans[plans["Flag"] == "FULL SCAN"]
+    print()
+    if flagged.empty:
+        print("No full table scans.")
+        return 0
+    for query, group in flagged.groupby("Query", sort=False):
+        print(f"{query}: full scan of {', '.join(sorted(set(group['Table'])))}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,693 @@
+### Report Engines
+# Alternatives to running the exN SQL in SQLite. Every engine returns the rows
+# pd.read_sql_query(exN(conn), conn) would: same columns, same rows and
+# bit-identical numbers, in the order the report's ORDER BY fixes. Rows the
+# ORDER BY leaves tied (every row of ex1, ex2 and ex10, which have none) come
+# out of SQLite in whatever order the query plan produces, and that changes
+# with indexes and statistics; REPORT_ORDER_BY records which columns are
+# ordered and normalize_report_order puts the tied rows in a fixed order so two
+# results can be compared.
+#
+# Identical numbers take two things:
+#   - SUM is a plain double accumulation up to SQLite 3.42, so group sums are
+#     accumulated (np.bincount, sequential) in the order the report's query
+#     plan visits rows when the report indexes exist. A different order can
+#     move a total across a rounding half-step. SQLite 3.43 switched SUM to
+#     Kahan-Babuska-Neumaier summation, which the engines do not reproduce;
+#     PLAIN_SUM says which one the running SQLite has, and on newer versions
+#     totals agree only to within one rounding unit (see check_parity).
+#   - ROUND(x) is reproduced exactly in numpy; ROUND(x, 2) goes through
+#     SQLite's own printf-based rounding, which Python's round() does not match.
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import sujal_codio_project as proj
+
+
+REPORTS = ["ex1", "ex2", "ex3", "ex4", "ex5", "ex6", "ex7", "ex8", "ex9", "ex10", "ex11"]
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December"]
+MONTH_CODES = {f"{i:02d}": name for i, name in enumerate(MONTH_NAMES, start=1)}
+QUARTER_NAMES = np.array(["Q1", "Q2", "Q3", "Q4"], dtype=object)
+
+# True when SQLite's SUM adds doubles one at a time, the summation the engines reproduce
+PLAIN_SUM = sqlite3.sqlite_version_info < (3, 43, 0)
+
+# Columns of each report's outermost ORDER BY
+REPORT_ORDER_BY = {
+    "ex1": (), "ex2": (), "ex3": ("Total",), "ex4": ("Total",), "ex5": ("Total",),
+    "ex6": ("Region",), "ex7": ("Region", "CountryRegionalRank"), "ex8": ("Year", "Quarter", "CustomerID"),
+    "ex9": ("Year",), "ex10": (), "ex11": ("MaxDaysWithoutOrder", "CustomerID"),
+}
+
+
+def normalize_report_order(name, frame):
+    # frame with each run of rows that tie on the ORDER BY columns (the whole
+    # frame when there are none) sorted on all columns. The ORDER BY columns
+    # keep their sequence, so a result out of ORDER BY order still differs.
+    keys = list(REPORT_ORDER_BY[name])
+    if keys:
+        run = frame[keys].ne(frame[keys].shift()).any(axis=1).cumsum().to_numpy()
+    else:
+        run = np.zeros(len(frame), "int64")
+    columns = list(frame.columns)
+    out = frame.assign(_run=run).sort_values(["_run"] + columns, kind="stable", na_position="first")
+    return out[columns].reset_index(drop=True)
+
+
+def sqlite_round(values, digits=0):
+    # ROUND(x, digits) exactly as SQLite computes it, for an array of doubles
+    values = np.asarray(values, dtype="float64")
+    if digits == 0:
+        # roundFunc: (double)(sqlite_int64)(r + 0.5), mirrored for negatives
+        return np.where(values >= 0, np.trunc(values + 0.5), -np.trunc(-values + 0.5))
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE TABLE v (x REAL)")
+        conn.executemany("INSERT INTO v (x) VALUES (?)", ((float(x),) for x in values))
+        rounded = conn.execute("SELECT ROUND(x, ?) FROM v ORDER BY rowid", (digits,)).fetchall()
+    finally:
+        conn.close()
+    return np.array([r[0] for r in rounded], dtype="float64")
+
+
+def _sqlite_int(text):
+    # CAST(text AS INTEGER): the leading optionally signed digits, 0 if there are none
+    match = re.match(r"\s*[+-]?\d+", text)
+    return int(match.group()) if match else 0
+
+
+def _lookup(ids, values, fill):
+    # Dense id -> value array so a foreign key column can be mapped with one gather
+    table = np.full(int(ids.max()) + 1 if len(ids) else 1, fill, dtype=np.asarray(values).dtype)
+    table[ids] = values
+    return table
+
+
+def _take(table, keys, fill):
+    # table[keys] with fill for keys outside the table (dangling foreign keys)
+    inside = (keys >= 0) & (keys < len(table))
+    out = np.full(len(keys), fill, dtype=table.dtype)
+    out[inside] = table[keys[inside]]
+    return out
+
+
+def _rank_desc(partition, values):
+    # SQL RANK() OVER (PARTITION BY partition ORDER BY values DESC)
+    frame = pd.DataFrame({"p": partition, "v": values})
+    return frame.groupby("p", sort=False)["v"].rank(method="min", ascending=False).astype("int64").to_numpy()
+
+
+def _sqlite_order_desc(values):
+    # ORDER BY value DESC through SQLite's sorter: records are prepended as they
+    # arrive and merge-sorted stably, so ties come out in reverse arrival order
+    reverse = np.arange(len(values))[::-1]
+    return reverse[np.argsort(-np.asarray(values)[reverse], kind="stable")]
+
+
+class ColumnarReportEngine:
+    # Computes ex1-ex11 from plain column arrays with numpy. Subclasses supply the
+    # arrays (Arrow snapshot, compact frames read from SQLite) through _load() as
+    # a dict of DataFrames keyed by table name, holding the columns of the
+    # normalized tables. Integer columns keep their dtype (int32 stays int32).
+    # Results are cached per (report, customer) until reload() or until _stale()
+    # reports that the source changed. One engine can serve several threads.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._results = {}
+        self._prepare(self._load())
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _stale(self):
+        return False
+
+    def reload(self):
+        with self._lock:
+            self._results = {}
+            self._prepare(self._load())
+
+    def _prepare(self, t):
+        od, cust, prod = t["OrderDetail"], t["Customer"], t["Product"]
+        country, region = t["Country"], t["Region"]
+
+        self.order_id = od["OrderID"].to_numpy()
+        self.cust_id = od["CustomerID"].to_numpy()
+        self.prod_id = od["ProductID"].to_numpy()
+        self.qty = od["QuantityOrdered"].to_numpy()
+        # Distinct OrderDate texts in sorted (BINARY) order and a code per row
+        date_code, dates = pd.factorize(od["OrderDate"], sort=True, use_na_sentinel=False)
+        self.date_code = date_code.astype("int32")
+        self.dates = np.asarray(dates, dtype=object)
+
+        pids = prod["ProductID"].to_numpy()
+        self.product_exists = _lookup(pids, np.ones(len(pids), bool), False)
+        self.product_price = _lookup(pids, prod["ProductUnitPrice"].to_numpy("float64"), np.nan)
+        self.product_name = _lookup(pids, prod["ProductName"].to_numpy(object), None)
+
+        cids = cust["CustomerID"].to_numpy()
+        first = cust["FirstName"].to_numpy(object)
+        last = cust["LastName"].to_numpy(object)
+        self.customer_exists = _lookup(cids, np.ones(len(cids), bool), False)
+        self.customer_country = _lookup(cids, cust["CountryID"].to_numpy(), -1)
+        self.customer_first = _lookup(cids, first, None)
+        self.customer_last = _lookup(cids, last, None)
+        full = np.array([f"{a} {b}" for a, b in zip(first, last)], dtype=object)
+        self.customer_name = _lookup(cids, full, None)
+        self.customers = cust[["CustomerID", "FirstName", "LastName", "CountryID"]]
+
+        coids = country["CountryID"].to_numpy()
+        self.country_exists = _lookup(coids, np.ones(len(coids), bool), False)
+        self.country_name = _lookup(coids, country["Country"].to_numpy(object), None)
+        self.country_region = _lookup(coids, country["RegionID"].to_numpy(), -1)
+        self.countries = country[["CountryID", "Country"]]
+
+        rids = region["RegionID"].to_numpy()
+        self.region_exists = _lookup(rids, np.ones(len(rids), bool), False)
+        self.region_name = _lookup(rids, region["Region"].to_numpy(object), None)
+
+        # ProductUnitPrice * QuantityOrdered, REAL * INTEGER as SQLite evaluates it
+        has_product = _take(self.product_exists, self.prod_id, False)
+        self.amount = _take(self.product_price, self.prod_id, np.nan) * self.qty
+        self.with_product = has_product
+        self.with_customer = has_product & _take(self.customer_exists, self.cust_id, False)
+        row_country = _take(self.customer_country, self.cust_id, -1)
+        self.row_country = row_country
+        self.with_country = self.with_customer & _take(self.country_exists, row_country, False)
+        row_region = _take(self.country_region, row_country, -1)
+        self.row_region = row_region
+        self.with_region = self.with_country & _take(self.region_exists, row_region, False)
+
+        # Visit orders of the usual report plans: customers in idx_Customer_Name
+        # order (FirstName, LastName, CustomerID), or by country, with each
+        # customer's orders in idx_OrderDetail_Customer_Date order; SCAN
+        # OrderDetail is OrderID order. They fix the order sums are accumulated
+        # in; the order of rows the ORDER BY leaves tied is not promised (a name
+        # shared by many customers can make SQLite scan OrderDetail for ex1).
+        within_customer = (self.order_id, self.qty, self.prod_id, self.date_code, self.cust_id)
+        self.by_name = np.lexsort(within_customer + (
+            _take(self.customer_last, self.cust_id, None).astype(str),
+            _take(self.customer_first, self.cust_id, None).astype(str)))
+        self.by_country = np.lexsort(within_customer + (row_country,))
+        self.by_order_id = np.argsort(self.order_id, kind="stable")
+
+        # Date parts are kept once per distinct OrderDate text (a few thousand
+        # entries); reports index them with date_code while aggregating
+        month = [d[5:7] if isinstance(d, str) else "" for d in self.dates]
+        self.date_month = np.array([MONTH_CODES.get(m) for m in month], dtype=object)
+        self.date_year = np.array([_sqlite_int(d[:4]) for d in self.dates], dtype="int16")
+        month_number = np.array([_sqlite_int(m) for m in month], dtype="int64")
+        # 0-3 for Q1-Q4, which sorts the same way as the quarter text
+        self.date_quarter = np.select([(month_number >= 1) & (month_number <= 3),
+                                       (month_number >= 4) & (month_number <= 6),
+                                       (month_number >= 7) & (month_number <= 9)], [0, 1, 2], 3).astype("int8")
+
+    def report(self, name, customer_name=None):
+        with self._lock:
+            if self._stale():
+                self.reload()
+            key = (name, customer_name if name in ("ex1", "ex2") else None)
+            if key not in self._results:
+                fn = getattr(self, "_" + name)
+                self._results[key] = fn(customer_name) if name in ("ex1", "ex2") else fn()
+            return self._results[key].copy()
+
+    def _customer_rows(self, customer_name):
+        names = _take(self.customer_name, self.cust_id, None)
+        mask = self.with_customer & (names == customer_name)
+        return self.by_name[mask[self.by_name]]
+
+    def _ex1(self, customer_name):
+        rows = self._customer_rows(customer_name)
+        return pd.DataFrame({
+            "Name": self.customer_name[self.cust_id[rows]],
+            "ProductName": self.product_name[self.prod_id[rows]],
+            "OrderDate": self.dates[self.date_code[rows]],
+            "ProductUnitPrice": self.product_price[self.prod_id[rows]],
+            "QuantityOrdered": self.qty[rows].astype("int64"),
+            "Total": sqlite_round(self.amount[rows], 2),
+        })
+
+    def _ex2(self, customer_name):
+        rows = self._customer_rows(customer_name)
+        if not len(rows):
+            return pd.DataFrame({"Name": pd.Series([], dtype=object), "Total": pd.Series([], dtype="float64")})
+        total = np.bincount(np.zeros(len(rows), "int64"), weights=self.amount[rows])
+        return pd.DataFrame({"Name": [customer_name], "Total": sqlite_round(total, 2)})
+
+    def _ex3(self):
+        order = self.by_name[self.with_customer[self.by_name]]
+        names = self.customer_name[self.cust_id[order]].astype(str)
+        keys, codes = np.unique(names, return_inverse=True)
+        sums = np.bincount(codes, weights=self.amount[order], minlength=len(keys))
+        total = sqlite_round(sums, 2)
+        out = _sqlite_order_desc(total)
+        return pd.DataFrame({"Name": keys[out].astype(object), "Total": total[out]})
+
+    def _ex4(self):
+        order = self.by_country[self.with_region[self.by_country]]
+        # idx_Country_Region visits countries by (RegionID, CountryID); only the
+        # order within each region's group matters, and that is CountryID order
+        regions = self.region_name[self.row_region[order]].astype(str)
+        keys, codes = np.unique(regions, return_inverse=True)
+        sums = np.bincount(codes, weights=self.amount[order], minlength=len(keys))
+        total = sqlite_round(sums, 2)
+        out = _sqlite_order_desc(total)
+        return pd.DataFrame({"Region": keys[out].astype(object), "Total": total[out]})
+
+    def _ex5(self):
+        order = self.by_country[self.with_country[self.by_country]]
+        countries = self.country_name[self.row_country[order]].astype(str)
+        keys, codes = np.unique(countries, return_inverse=True)
+        sums = np.bincount(codes, weights=self.amount[order], minlength=len(keys))
+        total = sqlite_round(sums)
+        out = _sqlite_order_desc(total)
+        return pd.DataFrame({"Country": keys[out].astype(object), "Total": total[out]})
+
+    def _region_country_sums(self):
+        order = self.by_country[self.with_region[self.by_country]]
+        frame = pd.DataFrame({
+            "Region": self.region_name[self.row_region[order]].astype(str),
+            "Country": self.country_name[self.row_country[order]].astype(str),
+        })
+        codes = frame.groupby(["Region", "Country"], sort=True).ngroup().to_numpy()
+        groups = frame.drop_duplicates().sort_values(["Region", "Country"], ignore_index=True)
+        sums = np.bincount(codes, weights=self.amount[order], minlength=len(groups))
+        rank = _rank_desc(groups["Region"].to_numpy(), sums)
+        # Window output: partitions in Region order, rows by SUM DESC, ties in group order
+        out = np.lexsort((-sums, groups["Region"].to_numpy()))
+        return groups.iloc[out].reset_index(drop=True), sqlite_round(sums[out]), rank[out]
+
+    def _ex6(self):
+        groups, total, rank = self._region_country_sums()
+        return pd.DataFrame({"Region": groups["Region"].astype(object), "Country": groups["Country"].astype(object),
+                             "CountryTotal": total, "TotalRank": rank})
+
+    def _ex7(self):
+        groups, total, rank = self._region_country_sums()
+        top = rank == 1
+        return pd.DataFrame({"Region": groups["Region"][top].astype(object).to_numpy(),
+                             "Country": groups["Country"][top].astype(object).to_numpy(),
+                             "CountryTotal": total[top], "CountryRegionalRank": rank[top]})
+
+    def _customer_quarter_totals(self):
+        order = self.by_order_id[self.with_product[self.by_order_id]]
+        codes = self.date_code[order]
+        frame = pd.DataFrame({"Quarter": self.date_quarter[codes], "Year": self.date_year[codes],
+                              "CustomerID": self.cust_id[order]})
+        grouped = frame.groupby(["Quarter", "Year", "CustomerID"], sort=True)
+        codes = grouped.ngroup().to_numpy()
+        groups = frame.drop_duplicates().sort_values(["Quarter", "Year", "CustomerID"], ignore_index=True)
+        sums = np.bincount(codes, weights=self.amount[order], minlength=len(groups))
+        # Only the (much shorter) group labels are turned back into report columns
+        groups["Quarter"] = QUARTER_NAMES[groups["Quarter"].to_numpy()]
+        groups = groups.astype({"Year": "int64", "CustomerID": "int64"})
+        groups["Total"] = sqlite_round(sums)
+        return groups
+
+    def _ex8(self):
+        groups = self._customer_quarter_totals()
+        groups = groups.sort_values(["Year", "Quarter", "CustomerID"], kind="stable", ignore_index=True)
+        groups["Quarter"] = groups["Quarter"].astype(object)
+        return groups[["Quarter", "Year", "CustomerID", "Total"]]
+
+    def _ex9(self):
+        groups = self._customer_quarter_totals()
+        part = groups["Year"].astype(str) + "|" + groups["Quarter"]
+        groups["CustomerRank"] = _rank_desc(part.to_numpy(), groups["Total"].to_numpy())
+        # Window order (Year, Quarter, Total DESC) with ties in group order, then ORDER BY Year
+        out = np.lexsort((-groups["Total"].to_numpy(), groups["Quarter"].to_numpy(), groups["Year"].to_numpy()))
+        groups = groups.iloc[out]
+        groups = groups[groups["CustomerRank"] <= 5].reset_index(drop=True)
+        groups["Quarter"] = groups["Quarter"].astype(object)
+        return groups[["Quarter", "Year", "CustomerID", "Total", "CustomerRank"]]
+
+    def _ex10(self):
+        rows = np.flatnonzero(self.with_product)
+        # GROUP BY Month: the NULL group (no month match) sorts first, then names as
+        # text; the group of every distinct date is worked out once
+        known = self.date_month != None  # noqa: E711
+        keys = np.unique(self.date_month[known].astype(str))
+        date_group = np.zeros(len(self.dates), "int32")
+        date_group[known] = np.searchsorted(keys, self.date_month[known].astype(str)) + 1
+        codes = date_group[self.date_code[rows]]
+        sums = np.bincount(codes, weights=sqlite_round(self.amount[rows]), minlength=len(keys) + 1)
+        groups = np.concatenate([[None], keys.astype(object)])
+        present = np.bincount(codes, minlength=len(keys) + 1) > 0
+        groups, totals = groups[present], sqlite_round(sums[present])
+        rank = _rank_desc(np.zeros(len(totals)), totals)
+        out = np.argsort(-totals, kind="stable")
+        return pd.DataFrame({"Month": groups[out], "Total": totals[out], "TotalRank": rank[out]})
+
+    def _ex11(self):
+        order = np.lexsort((self.date_code, self.cust_id))
+        orders = pd.DataFrame({"CustomerID": self.cust_id[order].astype("int64"),
+                               "OrderDate": self.dates[self.date_code[order]]})
+        customers = self.customers.merge(self.countries, on="CountryID", how="inner")
+        customers = customers[["CustomerID", "FirstName", "LastName", "Country"]].astype(
+            {"FirstName": object, "LastName": object, "Country": object})
+        return proj._ex11_from_frames(orders, customers)
+
+
+### Columnar Snapshot
+# export_snapshot writes the normalized tables (and SalesFact when it exists)
+# to one Arrow IPC file (uncompressed, so it can be memory-mapped) or Parquet
+# file per table, plus manifest.json with the load generation (PRAGMA
+# user_version) and row counts. Rows are streamed with fetchmany, so the export
+# never holds a whole table. The snapshot is written next to the target and
+# swapped in at the end, so readers never see a half-written one.
+
+SNAPSHOT_TABLES = proj.ETL_TABLE_ORDER + ["SalesFact"]
+
+_ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+
+def _arrow_schema(conn, table):
+    fields = []
+    for _, name, decl, notnull, _, _ in conn.execute("PRAGMA table_info(%s)" % table):
+        type_name = _ARROW_TYPES.get((decl or "").upper(), "string")
+        fields.append(pa.field(name, getattr(pa, type_name)(), nullable=not notnull))
+    return pa.schema(fields)
+
+
+def export_snapshot(normalized_database_filename, snapshot_dir, fmt="arrow", chunk_size=100000):
+    # Output: manifest dict (also written to snapshot_dir/manifest.json)
+    if fmt not in ("arrow", "parquet"):
+        raise ValueError(f"unknown snapshot format: {fmt}")
+    staging = snapshot_dir.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    conn = sqlite3.connect(normalized_database_filename)
+    manifest = {"format": fmt, "generation": conn.execute("PRAGMA user_version").fetchone()[0], "tables": {}}
+    try:
+        for table in SNAPSHOT_TABLES:
+            if not proj._table_exists(conn, table):
+                continue
+            schema = _arrow_schema(conn, table)
+            path = os.path.join(staging, f"{table}.{fmt}")
+            writer = pa.ipc.new_file(path, schema) if fmt == "arrow" else pq.ParquetWriter(path, schema)
+            rows = 0
+            try:
+                cur = conn.execute("SELECT %s FROM %s ORDER BY rowid" % (", ".join(schema.names), table)
+                                   if table != "SalesFact" else "SELECT * FROM SalesFact")
+                while True:
+                    batch = cur.fetchmany(chunk_size)
+                    if not batch:
+                        break
+                    columns = list(zip(*batch))
+                    arrays = [pa.array(col, type=field.type) for col, field in zip(columns, schema)]
+                    record_batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+                    writer.write_batch(record_batch)
+                    rows += len(batch)
+            finally:
+                writer.close()
+            manifest["tables"][table] = rows
+    finally:
+        conn.close()
+
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    previous = snapshot_dir.rstrip(os.sep) + ".old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(snapshot_dir):
+        os.rename(snapshot_dir, previous)
+    os.rename(staging, snapshot_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+
+def snapshot_generation(snapshot_dir):
+    # Load generation the snapshot was exported at, None if there is no snapshot
+    try:
+        with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+            return json.load(f)["generation"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_snapshot_table(snapshot_dir, table):
+    # pyarrow Table for one snapshot table; Arrow IPC files are memory-mapped
+    with open(os.path.join(snapshot_dir, "manifest.json")) as f:
+        fmt = json.load(f)["format"]
+    path = os.path.join(snapshot_dir, f"{table}.{fmt}")
+    if fmt == "arrow":
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return pq.read_table(path, memory_map=True)
+
+
+### Arrow Engine
+# ColumnarReportEngine over a snapshot: numeric columns come out of the
+# memory-mapped Arrow buffers as numpy arrays without going through Python
+# objects (only multi-chunk columns are concatenated once), which is where
+# pd.read_sql_query spends most of its time on large outputs.
+
+class ArrowReportEngine(ColumnarReportEngine):
+
+    def __init__(self, snapshot_dir):
+        self.snapshot_dir = snapshot_dir
+        super().__init__()
+
+    @property
+    def generation(self):
+        return self.manifest["generation"]
+
+    def _load(self):
+        with open(os.path.join(self.snapshot_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        tables = {}
+        for name in proj.ETL_TABLE_ORDER:
+            table = read_snapshot_table(self.snapshot_dir, name)
+            frame = {}
+            for column in table.column_names:
+                chunked = table.column(column)
+                numeric = pa.types.is_integer(chunked.type) or pa.types.is_floating(chunked.type)
+                if numeric and chunked.num_chunks == 1 and chunked.null_count == 0:
+                    frame[column] = chunked.chunk(0).to_numpy(zero_copy_only=True)
+                else:
+                    frame[column] = chunked.to_numpy()
+            tables[name] = pd.DataFrame(frame, copy=False)
+        return tables
+
+
+### Frame Engine
+# ColumnarReportEngine fed straight from SQLite, for when there is no current
+# snapshot. Each table the reports read is loaded once into a compact
+# frame: integer keys and quantities as int32 and repeated text (names, dates)
+# as categoricals, so the resident copy is a fraction of the object-dtype frame
+# read_sql_query returns. The engine reloads when the database changes, which
+# is detected the same way QueryResultCache does it: file identity, PRAGMA
+# user_version (the load generation) and PRAGMA data_version.
+
+FRAME_TABLES = {
+    "Region": "SELECT RegionID, Region FROM Region",
+    "Country": "SELECT CountryID, Country, RegionID FROM Country",
+    "Customer": "SELECT CustomerID, FirstName, LastName, CountryID FROM Customer",
+    "Product": "SELECT ProductID, ProductName, ProductUnitPrice FROM Product",
+    "OrderDetail": "SELECT OrderID, CustomerID, ProductID, OrderDate, QuantityOrdered FROM OrderDetail",
+}
+
+
+def compact_frame(df):
+    # int64 columns that fit become int32, text columns become categoricals
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values):
+            if values.empty or (values.min() >= np.iinfo("int32").min and values.max() <= np.iinfo("int32").max):
+                df[column] = values.astype("int32")
+        elif not pd.api.types.is_numeric_dtype(values):
+            df[column] = values.astype("category")
+    return df
+
+
+class FrameReportEngine(ColumnarReportEngine):
+
+    def __init__(self, normalized_database_filename):
+        self.db_path = normalized_database_filename
+        self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._inode = None
+        self.version = None
+        super().__init__()
+
+    @property
+    def generation(self):
+        return self.version[1]
+
+    def _data_version(self):
+        try:
+            inode = os.stat(self.db_path).st_ino
+        except OSError:
+            inode = None
+        if inode != self._inode and self._inode is not None:
+            # The file was replaced; the old connection would never see new data
+            self._version_conn.close()
+            self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._inode = inode
+        user_version = self._version_conn.execute("PRAGMA user_version").fetchone()[0]
+        data_version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+        return (inode, user_version, data_version)
+
+    def _stale(self):
+        return self._data_version() != self.version
+
+    def _load(self):
+        self.version = self._data_version()
+        uri = "file:" + os.path.abspath(self.db_path) + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            self.frames = {name: compact_frame(pd.read_sql_query(sql, conn)) for name, sql in FRAME_TABLES.items()}
+        finally:
+            conn.close()
+        return self.frames
+
+    def memory_usage(self):
+        # Bytes held by the compact frames, per table
+        return {name: int(df.memory_usage(deep=True).sum()) for name, df in self.frames.items()}
+
+
+### Parity Checks
+# check_parity compares an engine with pd.read_sql_query on the exN SQL with
+# check_exact: same rows and bit-identical floats, in the same order wherever
+# the report's ORDER BY fixes it (both sides go through normalize_report_order,
+# so rows a plan may return in any order are compared as a multiset).
+# check_round and check_rank_ties pin down the two spots an engine can get
+# subtly wrong, ROUND at half-way points and the order of tied totals under
+# RANK() and ORDER BY. Each returns a DataFrame (Check, Report, Customer, Rows,
+# Ok, Detail); report_parity.py runs all three from the command line.
+
+def _parity_row(check, report, customer, rows, ok, detail=""):
+    return {"Check": check, "Report": report, "Customer": customer, "Rows": rows, "Ok": ok, "Detail": detail}
+
+
+def parity_customers(conn, limit=3):
+    # A few customers to run ex1/ex2 for: the ones with the most orders, the
+    # first by name, the name most customers share (which can change the ex1
+    # plan), and a name that matches nobody
+    rows = conn.execute("""
+        SELECT C.FirstName || ' ' || C.LastName FROM OrderDetail O
+        JOIN Customer C ON O.CustomerID = C.CustomerID
+        GROUP BY C.CustomerID ORDER BY COUNT(*) DESC, C.CustomerID LIMIT ?""", (limit,)).fetchall()
+    first = conn.execute("SELECT FirstName || ' ' || LastName FROM Customer ORDER BY FirstName, LastName LIMIT 1").fetchall()
+    shared = conn.execute("""
+        SELECT FirstName || ' ' || LastName FROM Customer
+        GROUP BY FirstName, LastName HAVING COUNT(*) > 1
+        ORDER BY COUNT(*) DESC, FirstName, LastName LIMIT 1""").fetchall()
+    # ex1/ex2 paste the name into the SQL, so names with quotes cannot be compared
+    names = [r[0] for r in rows + first + shared if "'" not in r[0]]
+    return list(dict.fromkeys(names)) + ["No Such Customer"]
+
+
+def _sorted_on_labels(frame):
+    # frame sorted on its non-float columns first, so rows pair up even when
+    # float totals (and the order they were sorted in) moved a little
+    labels = [c for c in frame.columns if not pd.api.types.is_float_dtype(frame[c])]
+    others = [c for c in frame.columns if c not in labels]
+    return frame.sort_values(labels + others, kind="stable", na_position="first").reset_index(drop=True)
+
+
+def check_parity(conn, engine, reports=REPORTS, customer_names=None, exact=None):
+    # exact defaults to PLAIN_SUM. Without it, float columns may differ by up to
+    # one rounding unit (1.0 covers both ROUND(x) and ROUND(x, 2)) and rows are
+    # paired on their other columns, which still have to match exactly.
+    if customer_names is None:
+        customer_names = parity_customers(conn)
+    if exact is None:
+        exact = PLAIN_SUM
+    detail = "" if exact else f"totals within one rounding unit (SQLite {sqlite3.sqlite_version})"
+    results = []
+    for name in reports:
+        for customer in (customer_names if name in ("ex1", "ex2") else [None]):
+            expected = run_report(None, conn, name, customer)
+            try:
+                got = engine.report(name, customer)
+                if exact:
+                    pd.testing.assert_frame_equal(normalize_report_order(name, got),
+                                                  normalize_report_order(name, expected),
+                                                  check_dtype=False, check_exact=True)
+                else:
+                    pd.testing.assert_frame_equal(_sorted_on_labels(got), _sorted_on_labels(expected),
+                                                  check_dtype=False, check_exact=False, rtol=0, atol=1.0)
+                results.append(_parity_row("report", name, customer, len(expected), True, detail))
+            except AssertionError as e:
+                results.append(_parity_row("report", name, customer, len(expected), False, str(e).splitlines()[0]))
+    return pd.DataFrame(results)
+
+
+ROUND_EDGE_VALUES = [0.5, 1.5, 2.5, -0.5, -1.5, 0.49999999999999994, 2.675, 1.005, 0.125, 0.375, -2.675,
+                     1234.565, 99999.995, 4503599627370495.5, 1e16 + 2, 0.0, -0.0]
+
+
+def check_round(values=None, seed=503):
+    # sqlite_round against SQLite's ROUND for digits 0 and 2, on half-way edge
+    # cases plus line totals shaped like the data (price * quantity). Runs on a
+    # private in-memory database, so it never holds a transaction on the data.
+    if values is None:
+        rng = np.random.default_rng(seed)
+        prices = np.round(rng.uniform(0.5, 2000, 20000), 2)
+        values = np.concatenate([ROUND_EDGE_VALUES, prices * rng.integers(1, 20, len(prices)),
+                                 np.arange(-200, 200) + 0.5, np.arange(0, 100) / 200 + 0.005])
+    values = np.asarray(values, dtype="float64")
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ParityRound (x REAL)")
+    conn.executemany("INSERT INTO ParityRound (x) VALUES (?)", ((float(x),) for x in values))
+    results = []
+    for digits in (0, 2):
+        expected = np.array([r[0] for r in conn.execute(
+            "SELECT ROUND(x, ?) FROM ParityRound ORDER BY rowid", (digits,))], dtype="float64")
+        got = sqlite_round(values, digits)
+        bad = np.flatnonzero(got != expected)
+        detail = ", ".join(f"{float(values[i])!r}: {float(got[i])!r} != {float(expected[i])!r}" for i in bad[:5])
+        results.append(_parity_row("round", f"ROUND(x, {digits})", None, len(values), not len(bad), detail))
+    conn.close()
+    return pd.DataFrame(results)
+
+
+def check_rank_ties(groups=200, seed=503):
+    # RANK() OVER (PARTITION BY ... ORDER BY v DESC) and ORDER BY v DESC on
+    # grouped totals where many totals tie, against SQLite (in memory, as above)
+    rng = np.random.default_rng(seed)
+    keys = np.array([f"G{i:04d}" for i in range(groups)], dtype=object)
+    partition = rng.integers(0, 5, groups)
+    totals = rng.integers(0, 8, groups).astype("float64") * 10
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ParityRank (k TEXT, p INTEGER, v REAL)")
+    rows = [(k, int(p), float(v) / 2) for k, p, v in zip(keys, partition, totals) for _ in range(2)]
+    conn.executemany("INSERT INTO ParityRank (k, p, v) VALUES (?, ?, ?)", rows)
+
+    results = []
+    expected = conn.execute("""
+        SELECT k, RANK() OVER (PARTITION BY p ORDER BY SUM(v) DESC) FROM ParityRank
+        GROUP BY k ORDER BY k""").fetchall()
+    ranks = _rank_desc(partition, totals)
+    ok = [r[1] for r in expected] == list(ranks)
+    results.append(_parity_row("rank_ties", "RANK() OVER (PARTITION BY p ORDER BY total DESC)", None, groups, ok))
+
+    expected = [r[0] for r in conn.execute("SELECT k, SUM(v) AS Total FROM ParityRank GROUP BY k ORDER BY Total DESC")]
+    got = list(keys[_sqlite_order_desc(totals)])
+    ok = expected == got
+    detail = "" if ok else f"first difference at row {next(i for i, (a, b) in enumerate(zip(expected, got)) if a != b)}"
+    results.append(_parity_row("rank_ties", "GROUP BY k ORDER BY total DESC", None, groups, ok, detail))
+    conn.close()
+    return pd.DataFrame(results)
+
+
+def run_report(engine, conn, name, customer_name=None):
+    # One exN report through the chosen engine; engine None runs the SQL in SQLite
+    if engine is None:
+        fn = getattr(proj, name)
+        sql = fn(conn, customer_name) if name in ("ex1", "ex2") else fn(conn)
+        return pd.read_sql_query(sql, conn)
+    return engine.report(name, customer_name)
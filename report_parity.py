@@ -0,0 +1,58 @@
+### Report Engine Parity
+# Checks that an alternative report engine returns exactly the rows the exN SQL
+# returns in SQLite (in ORDER BY order; tied rows in any order), plus the ROUND
+# and rank-tie checks behind it.
+# Usage: python report_parity.py [normalized.db] [--engine=frame|arrow] [--snapshot=DIR]
+# The arrow engine reads DIR (default: a fresh snapshot in a temporary directory).
+# Exits with status 1 when any check fails.
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from report_engines import (
+    PLAIN_SUM, ArrowReportEngine, FrameReportEngine, check_parity, check_rank_ties, check_round, export_snapshot,
+)
+from sujal_codio_project import create_connection
+
+
+def main(argv):
+    args = [a for a in argv if not a.startswith("--")]
+    options = dict(a[2:].split("=", 1) for a in argv if a.startswith("--") and "=" in a)
+    db_file = args[0] if args else "normalized.db"
+    engine_name = options.get("engine", "frame")
+
+    started = time.perf_counter()
+    if engine_name == "arrow":
+        snapshot_dir = options.get("snapshot")
+        if snapshot_dir is None:
+            snapshot_dir = tempfile.mkdtemp(prefix="snapshot-")
+            export_snapshot(db_file, snapshot_dir)
+        engine = ArrowReportEngine(snapshot_dir)
+    else:
+        engine = FrameReportEngine(db_file)
+    print(f"Loaded {engine_name} engine in {time.perf_counter() - started:.2f}s")
+    if not PLAIN_SUM:
+        print(f"SQLite {sqlite3.sqlite_version} compensates SUM; totals are compared to within one rounding unit")
+
+    conn = create_connection(db_file)
+    results = pd.concat([check_round(), check_rank_ties(), check_parity(conn, engine)],
+                        ignore_index=True)
+    conn.close()
+
+    with pd.option_context("display.max_rows", None, "display.max_colwidth", 80, "display.width", 160):
+        print(results.to_string(index=False))
+
+    failed = results[~results["Ok"]]
+    print()
+    if failed.empty:
+        print(f"All {len(results)} checks match SQLite.")
+        return 0
+    print(f"{len(failed)} of {len(results)} checks differ from SQLite.")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
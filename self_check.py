@@ -0,0 +1,203 @@
+### Self Checks
+# End-to-end checks of behaviour the reports and the dashboard rely on, run
+# against throwaway files in a temporary directory.
+# Usage: python self_check.py [check ...]
+# With no arguments every check runs. Exits with status 1 when any check fails.
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import traceback
+
+import benchmarks
+import sujal_codio_project as proj
+from dashboard_backend import (
+    FakeGroqClient, QueryGuard, ReadOnlyConnectionPool, ReportRunner, SQLStreamParser, stream_translation,
+)
+
+
+def _count(db_filename, table):
+    conn = sqlite3.connect(db_filename)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _append_source(target, extra):
+    # Appends extra's data lines (not its header) to target
+    with open(extra, 'rb') as src, open(target, 'ab') as dst:
+        src.readline()
+        dst.write(src.read())
+
+
+def check_full_then_incremental(workdir):
+    # A full load followed by an incremental run of the same file changes nothing;
+    # lines appended afterwards are applied once; a rebuild starts the log afresh
+    data = os.path.join(workdir, "orders.tsv")
+    delta = os.path.join(workdir, "delta.tsv")
+    db = os.path.join(workdir, "ingest.db")
+    benchmarks.generate_sales_tsv(data, 2000, seed=11)
+    benchmarks.generate_sales_tsv(delta, 300, seed=12)
+
+    proj.run_etl_pipeline(data, db, verbose=False)
+    loaded = _count(db, "OrderDetail")
+    counts = proj.incremental_ingest(data, db)
+    assert _count(db, "OrderDetail") == loaded, "incremental run of the loaded file added orders"
+    assert counts["orders"] == 0 and counts["lines_read"] == 0, counts
+
+    _append_source(data, delta)
+    counts = proj.incremental_ingest(data, db)
+    grown = _count(db, "OrderDetail")
+    assert counts["orders"] > 0 and grown == loaded + counts["orders"], (loaded, grown, counts)
+    assert proj.incremental_ingest(data, db)["orders"] == 0, "second incremental run added orders"
+
+    # Rebuilding from the original file must not keep the delta's line hashes
+    benchmarks.generate_sales_tsv(data, 2000, seed=11)
+    proj.run_etl_pipeline(data, db, verbose=False)
+    _append_source(data, delta)
+    counts = proj.incremental_ingest(data, db)
+    assert _count(db, "OrderDetail") == grown, "lines from before the rebuild were skipped"
+
+    # Identical lines are separate orders, also when appended later; a copy adds nothing
+    fresh = os.path.join(workdir, "fresh.tsv")
+    benchmarks.generate_sales_tsv(fresh, 1, seed=13)
+    with open(fresh, 'rb') as f:
+        header, line = f.readline(), f.readline()
+    repeated = os.path.join(workdir, "repeated.tsv")
+    with open(repeated, 'wb') as f:
+        f.write(header + line + line)
+    twice = proj.incremental_ingest(repeated, db)
+    assert twice["orders"] > 0 and twice["orders"] % 2 == 0 and twice["lines_skipped"] == 0, twice
+    shutil.copy(repeated, os.path.join(workdir, "repeated_copy.tsv"))
+    counts = proj.incremental_ingest(os.path.join(workdir, "repeated_copy.tsv"), db)
+    assert counts["orders"] == 0 and counts["lines_skipped"] == 2, counts
+    with open(repeated, 'ab') as f:
+        f.write(line)
+    counts = proj.incremental_ingest(repeated, db)
+    assert counts["orders"] == twice["orders"] // 2 and counts["lines_skipped"] == 0, counts
+
+    # The stepN path records the same log
+    step_db = os.path.join(workdir, "steps.db")
+    for step in (proj.step1_create_region_table, proj.step3_create_country_table,
+                 proj.step5_create_customer_table, proj.step7_create_productcategory_table,
+                 proj.step9_create_product_table, proj.step11_create_orderdetail_table):
+        step(data, step_db)
+    before = _count(step_db, "OrderDetail")
+    assert proj.incremental_ingest(data, step_db)["orders"] == 0 and _count(step_db, "OrderDetail") == before
+    return f"{loaded} orders loaded, +{grown - loaded} from the appended lines"
+
+
+def _rollup_rows(db_filename):
+    conn = sqlite3.connect(db_filename)
+    try:
+        return {name: (row_count, conn.execute("SELECT * FROM %s ORDER BY %s" % (name, grain)).fetchall())
+                for name, grain, row_count in conn.execute("SELECT Name, Grain, RowCount FROM SalesRollupLevel")}
+    finally:
+        conn.close()
+
+
+def check_rollup_refresh(workdir):
+    # Rollups merged by incremental_ingest hold exactly what a rebuild stores, for
+    # appended orders and for orders rewritten after product prices change, and
+    # the reports over SalesFact and the rollups agree with the raw SQL
+    data = os.path.join(workdir, "orders.tsv")
+    db = os.path.join(workdir, "rollup.db")
+    rebuilt = os.path.join(workdir, "rebuilt.db")
+    benchmarks.generate_sales_tsv(data, 3000, seed=11)
+    proj.run_etl_pipeline(data, db, verbose=False)
+    # Same seed: the same products at the same prices, so only appends
+    appended = os.path.join(workdir, "appended.tsv")
+    benchmarks.generate_sales_tsv(appended, 400, seed=11, n_products=400)
+    # Another seed prices the same product names differently
+    repriced = os.path.join(workdir, "repriced.tsv")
+    benchmarks.generate_sales_tsv(repriced, 400, seed=12)
+
+    for extra, rewrites in ((appended, False), (repriced, True)):
+        _append_source(data, extra)
+        counts = proj.incremental_ingest(data, db)
+        assert counts["orders"] and (counts["sales_fact_rows"] > counts["orders"]) == rewrites, counts
+        shutil.copy(db, rebuilt)
+        conn = sqlite3.connect(rebuilt)
+        proj.build_sales_rollups(conn)
+        conn.close()
+        got, want = _rollup_rows(db), _rollup_rows(rebuilt)
+        for name in want:
+            assert got[name] == want[name], f"{name} differs from a rebuild after {os.path.basename(extra)}"
+    # The exN_rollup and exN_fact reports still answer like the raw exN SQL
+    conn = sqlite3.connect(db)
+    try:
+        consistency = proj.check_rollup_consistency(conn)
+    finally:
+        conn.close()
+    # Totals on an exact rounding half-step may round the other way (HalfStepTies); anything else is drift
+    drifted = consistency.loc[consistency["Mismatches"] > 0, ["Report", "Source"]].values.tolist()
+    assert not drifted, drifted
+    return (f"{len(want)} levels match a rebuild, {len(consistency)} rollup/fact reports match the raw SQL "
+            f"({consistency['HalfStepTies'].sum()} half-step ties)")
+
+
+def check_streaming(workdir):
+    # The AI Analyst path: SQL streamed by FakeGroqClient is picked up by
+    # SQLStreamParser at the closing fence, before the model's trailing prose,
+    # and the early statement runs under the guard like the app runs it
+    parser = SQLStreamParser()
+    found = [parser.feed(delta) for delta in ["SELECT 1", " FROM Region", ";", " -- done"]]
+    assert found == [False, False, True, False] and parser.statement == "SELECT 1 FROM Region;", found
+    parser = SQLStreamParser()
+    assert not parser.feed("SELECT Region FROM Region") and parser.finish() and not parser.finish()
+
+    data = os.path.join(workdir, "orders.tsv")
+    db = os.path.join(workdir, "stream.db")
+    benchmarks.generate_sales_tsv(data, 500, seed=11)
+    proj.run_etl_pipeline(data, db, verbose=False)
+
+    sql = "SELECT Region, COUNT(*) AS Countries\nFROM Country JOIN Region USING (RegionID)\nGROUP BY Region"
+    client = FakeGroqClient({"countries per region": sql}, first_token_delay=0, token_delay=0.005,
+                            trailer="\nThis query counts the countries in each region.")
+    messages = [{"role": "user", "content": "How many countries per region?"}]
+    texts, statements, jobs = [], [], []
+    runner = ReportRunner(ReadOnlyConnectionPool(db, max_size=2), max_workers=1)
+
+    def on_statement(statement):
+        statements.append(statement)
+        jobs.append(runner.submit("ai", statement, guard=QueryGuard()))
+
+    got, timings = stream_translation(client, "fake-model", messages, on_text=texts.append,
+                                      on_statement=on_statement)
+    assert got == sql and statements == [sql], (got, statements)
+    assert client.calls == 1 and texts[-1] == sql
+    assert 0 <= timings["first_token"] <= timings["statement"] < timings["llm_total"], timings
+    df = jobs[0].result(timeout=30)
+    assert len(df) == _count(db, "Region") and not df.attrs["guard"]["truncated"], df
+    return (f"statement after {timings['statement'] * 1000:.0f} of {timings['llm_total'] * 1000:.0f} ms, "
+            f"{len(df)} rows")
+
+
+CHECKS = {
+    "ingest": check_full_then_incremental,
+    "rollups": check_rollup_refresh,
+    "streaming": check_streaming,
+}
+
+
+def main(argv):
+    names = argv or list(CHECKS)
+    failed = 0
+    for name in names:
+        with tempfile.TemporaryDirectory() as workdir:
+            try:
+                detail = CHECKS[name](workdir)
+                print(f"ok    {name:<12} {detail or ''}")
+            except Exception:
+                failed += 1
+                print(f"FAIL  {name}")
+                traceback.print_exc()
+    print()
+    print(f"{len(names) - failed} of {len(names)} checks passed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))